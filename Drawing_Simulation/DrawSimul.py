@@ -108,3 +108,25 @@ class DrawSimul:
             self.draw_rand_id()
 
         return self.dwg_results
+
+
+def simulate_odds(expected_apps: list, tag: str, num_tags: int, num_dwgs: int):
+    """Runs the drawing num_dwgs times and returns the total number of tags obtained by each point category along with
+    the % chance of drawing for each point category."""
+    # a drawing can't hand out more tags than there are applicants (draw_rand_id would keep retrying forever)
+    num_tags = min(num_tags, sum(expected_apps))
+
+    total_results = [0] * len(expected_apps)
+    for _ in range(num_dwgs):
+        results = DrawSimul(expected_apps, tag, num_tags).run_drawing()
+        for i, result in enumerate(results):
+            total_results[i] += result
+
+    perc_chance_of_success = []
+    for i, result in enumerate(total_results):
+        if expected_apps[i] == 0:
+            perc_chance_of_success.append(0)
+        else:
+            perc_chance_of_success.append(round((result / (expected_apps[i] * num_dwgs)) * 100, 1))
+
+    return total_results, perc_chance_of_success
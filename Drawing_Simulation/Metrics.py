@@ -0,0 +1,55 @@
+# This file contains the instrumentation used by the drawing simulation server. It times the simulations run for each
+# request and keeps prometheus style histograms of them for the /metrics endpoint. The histogram and request timing
+# classes are shared with the Queries server (Queries/RequestMetrics.py).
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Queries'))
+import RequestMetrics
+from RequestMetrics import Histogram
+
+REQUEST_DURATION = Histogram('drawing_request_duration_seconds', 'Total time spent handling a request.', ('route',))
+SIMULATION_DURATION = Histogram('drawing_simulation_duration_seconds',
+                                'Time spent running the drawing simulations for a request.', ('route',))
+
+ALL_HISTOGRAMS = [REQUEST_DURATION, SIMULATION_DURATION]
+
+_current = RequestMetrics.CurrentRequest()
+
+
+def start_request(route: str):
+    stats = RequestMetrics.RequestStats(route)
+    _current.set(stats)
+    return stats
+
+
+def current_request():
+    return _current.get()
+
+
+def end_request():
+    """Records the request duration and returns the stats for the request that just finished"""
+    stats = _current.pop()
+    if stats is not None:
+        REQUEST_DURATION.observe(time.perf_counter() - stats.start, route=stats.route)
+    return stats
+
+
+@contextmanager
+def simulation_timer():
+    """Times the simulations run inside the with statement"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        stats = current_request()
+        if stats is not None:
+            stats.add_section('simulation', duration)
+            SIMULATION_DURATION.observe(duration, route=stats.route)
+
+
+def render_metrics():
+    return RequestMetrics.render_histograms(ALL_HISTOGRAMS)
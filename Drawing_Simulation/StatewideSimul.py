@@ -0,0 +1,154 @@
+# This file simulates the drawing for every tag of a species at once. Every applicant is part of one statewide pool and
+# may list a second choice, so the bonus points in one tag's drawing also affect the competition for other tags.
+#
+# The applicant pool is held as arrays (points, first choice, second choice) and each drawing is done with array
+# operations. Drawing from the bag in DrawSimul (points squared entries per applicant, redrawing anyone already drawn) is
+# the same as giving every applicant a key of Exp(1) / (points squared) and handing the tags out in key order, which is
+# what happens here. Iterations are split over worker processes.
+import os
+from multiprocessing import Pool
+import numpy as np
+
+NUM_POINTS = 21
+
+
+def point_weights(points: np.ndarray):
+    """Number of entries each applicant gets in the drawing (points squared, 1 entry at 0 points)"""
+    weights = points.astype(np.float64) ** 2
+    weights[points == 0] = 1
+    return weights
+
+
+class ApplicantPool:
+    """The statewide applicants. first and second are tag positions (second is -1 when there is no second choice)."""
+
+    def __init__(self, points: np.ndarray, first: np.ndarray, second: np.ndarray, num_tags: int):
+        self.points = points.astype(np.int64)
+        self.first = first.astype(np.int64)
+        self.second = second.astype(np.int64)
+        self.num_tags = num_tags
+        self.num_points = max(NUM_POINTS, int(self.points.max()) + 1 if len(self.points) else 0)
+        self.weights = point_weights(self.points)
+
+    @classmethod
+    def from_tag_counts(cls, tag_apps: np.ndarray, second_choices: dict = None, seed=None):
+        """Builds the pool from a (tags, points) array of first choice applicants. second_choices maps a tag position
+        to {other tag position: fraction of its applicants listing that tag as their second choice}."""
+        num_tags, num_points = tag_apps.shape
+        counts = tag_apps.ravel()
+        first = np.repeat(np.repeat(np.arange(num_tags), num_points), counts)
+        points = np.repeat(np.tile(np.arange(num_points), num_tags), counts)
+        second = np.full(len(first), -1, dtype=np.int64)
+
+        rng = np.random.default_rng(seed)
+        starts = np.concatenate(([0], np.cumsum(tag_apps.sum(axis=1))))
+        for tag_pos, choices in (second_choices or {}).items():
+            options = np.array(list(choices) + [-1], dtype=np.int64)
+            fractions = np.array(list(choices.values()), dtype=np.float64)
+            probabilities = np.append(fractions, max(0.0, 1 - fractions.sum()))
+            start, end = starts[tag_pos], starts[tag_pos + 1]
+            second[start:end] = rng.choice(options, size=end - start, p=probabilities / probabilities.sum())
+
+        return cls(points, first, second, num_tags)
+
+
+def allocate(choice: np.ndarray, keys: np.ndarray, eligible: np.ndarray, quotas: np.ndarray):
+    """Hands out quotas[tag] tags to the eligible applicants choosing each tag, lowest key first. Returns a boolean
+    array of the applicants that drew."""
+    candidates = np.flatnonzero(eligible & (choice >= 0))
+
+    # sort by tag then key with a single argsort: key / (1 + key) keeps the key order but fits it inside [0, 1)
+    sort_keys = choice[candidates] + keys[candidates] / (1 + keys[candidates])
+    order = candidates[np.argsort(sort_keys)]
+    chosen = choice[order]
+
+    # position of each applicant within the line for their tag
+    group_start = np.searchsorted(chosen, np.arange(len(quotas)))
+    rank = np.arange(len(order)) - group_start[chosen]
+
+    drew = np.zeros(len(choice), dtype=bool)
+    drew[order[rank < quotas[chosen]]] = True
+    return drew
+
+
+def run_drawings(pool: ApplicantPool, quotas: np.ndarray, iterations: int, seed=None):
+    """Runs the statewide drawing iterations times. Returns (first choice wins, second choice wins), both (tags, points)
+    arrays totalled over the iterations."""
+    rng = np.random.default_rng(seed)
+    num_cells = pool.num_tags * pool.num_points
+    first_cells = pool.first * pool.num_points + pool.points
+    has_second = pool.second >= 0
+    second_cells = pool.second[has_second] * pool.num_points + pool.points[has_second]
+
+    first_wins = np.zeros(num_cells, dtype=np.int64)
+    second_wins = np.zeros(num_cells, dtype=np.int64)
+    everyone = np.ones(len(pool.points), dtype=bool)
+    for _ in range(iterations):
+        keys = rng.standard_exponential(len(pool.points)) / pool.weights
+
+        # first choices are drawn for every tag, then the tags left over go to the second choices of those who missed
+        drew_first = allocate(pool.first, keys, everyone, quotas)
+        remaining = quotas - np.bincount(pool.first[drew_first], minlength=pool.num_tags)
+        drew_second = allocate(pool.second, keys, ~drew_first, remaining)
+
+        first_wins += np.bincount(first_cells[drew_first], minlength=num_cells)
+        second_wins += np.bincount(second_cells[drew_second[has_second]], minlength=num_cells)
+
+    return first_wins.reshape(pool.num_tags, pool.num_points), second_wins.reshape(pool.num_tags, pool.num_points)
+
+
+def _run_chunk(args):
+    return run_drawings(*args)
+
+
+class StatewideDrawing:
+    """Simulates the drawing for all the tags of a species/year over a shared applicant pool."""
+
+    def __init__(self, pool: ApplicantPool, quotas: list):
+        self.pool = pool
+        self.quotas = np.asarray(quotas, dtype=np.int64)
+
+    def run(self, iterations: int, workers: int = None, seed=None):
+        """Runs the iterations split over workers processes and returns the StatewideResults"""
+        workers = max(1, min(workers or os.cpu_count(), iterations))
+        seeds = np.random.SeedSequence(seed).spawn(workers)
+        chunks = [(self.pool, self.quotas, iterations // workers + (i < iterations % workers), seeds[i])
+                  for i in range(workers)]
+
+        if workers == 1:
+            totals = [_run_chunk(chunks[0])]
+        else:
+            with Pool(workers) as process_pool:
+                totals = process_pool.map(_run_chunk, chunks)
+
+        first_wins = sum(total[0] for total in totals)
+        second_wins = sum(total[1] for total in totals)
+        return StatewideResults(self.pool, first_wins, second_wins, iterations)
+
+
+class StatewideResults:
+    """Totals of a statewide simulation, with the odds per tag and point category."""
+
+    def __init__(self, pool: ApplicantPool, first_wins: np.ndarray, second_wins: np.ndarray, iterations: int):
+        self.first_wins = first_wins
+        self.second_wins = second_wins
+        self.iterations = iterations
+        self.first_apps = np.bincount(pool.first * pool.num_points + pool.points,
+                                      minlength=pool.num_tags * pool.num_points).reshape(pool.num_tags, pool.num_points)
+        has_second = pool.second >= 0
+        self.second_apps = np.bincount(pool.second[has_second] * pool.num_points + pool.points[has_second],
+                                       minlength=pool.num_tags * pool.num_points).reshape(pool.num_tags, pool.num_points)
+
+    @staticmethod
+    def _perc(wins: np.ndarray, apps: np.ndarray, iterations: int):
+        ratio = np.divide(wins, apps * iterations, out=np.zeros(wins.shape), where=apps > 0)
+        return np.round(ratio * 100, 1)
+
+    def first_choice_perc(self):
+        """(tags, points) % chance of drawing the tag for applicants who list it as their first choice"""
+        return self._perc(self.first_wins, self.first_apps, self.iterations)
+
+    def second_choice_perc(self):
+        """(tags, points) % chance of drawing the tag for applicants who list it as their second choice (out of all of
+        them, including those who drew their first choice)"""
+        return self._perc(self.second_wins, self.second_apps, self.iterations)
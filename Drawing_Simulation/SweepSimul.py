@@ -0,0 +1,69 @@
+# This file simulates one tag's drawing over a grid of scenarios (numbers of tags x scalings of the applicants) at once,
+# for planning questions like "what if the quota drops to 6 tags" or "what if applicants grow 15%".
+#
+# Every scenario uses the same random draws (common random numbers), so the differences between scenarios come from the
+# scenarios rather than from noise. Each simulated year draws a key of Exp(1) / (points squared) for every applicant of
+# the largest scaling (the same drawing as the bag, see StatewideSimul). A smaller scaling uses the first applicants of
+# each point category, so the populations are nested. The applicants are sorted by key once per scaling, and the tags
+# drawn for every number of tags are read off the running count of each point category along that order.
+import numpy as np
+from StatewideSimul import point_weights
+
+# simulated years per batch, which bounds the memory used
+BATCH_SIZE = 256
+
+
+def scaled_applicants(expected_apps: list, scale: float):
+    """Applicants per point category with the expected applicants scaled"""
+    return np.rint(np.asarray(expected_apps, dtype=np.float64) * scale).astype(np.int64)
+
+
+def lowest_keys(keys: np.ndarray, n: int):
+    """Returns the positions of the n lowest keys of each row, in key order"""
+    if n < keys.shape[1]:
+        lowest = np.argpartition(keys, n - 1, axis=1)[:, :n] if n > 0 else np.zeros((len(keys), 0), dtype=np.int64)
+        return np.take_along_axis(lowest, np.argsort(np.take_along_axis(keys, lowest, axis=1), axis=1), axis=1)
+    return np.argsort(keys, axis=1)
+
+
+def sweep_odds(expected_apps: list, num_tags: list, scales: list, iterations: int, seed=None):
+    """Simulates the drawing iterations times for every number of tags and scaling. Returns (applicants, wins, perc)
+    where applicants is (scales, points), wins is the tags drawn totalled over the iterations and perc the % chance of
+    drawing a tag, both (scales, num_tags, points)."""
+    num_tags = np.asarray(num_tags, dtype=np.int64)
+    applicants = np.stack([scaled_applicants(expected_apps, scale) for scale in scales])
+    num_points = applicants.shape[1]
+
+    # the largest population (every scaling's applicants are the first ones of each point category in it)
+    most_apps = applicants.max(axis=0)
+    points = np.repeat(np.arange(num_points), most_apps)
+    slot = np.arange(len(points)) - np.repeat(np.cumsum(most_apps) - most_apps, most_apps)
+    weights = point_weights(points)
+    in_scale = slot[None, :] < applicants[:, points]
+    max_tags = int(num_tags.max()) if len(num_tags) else 0
+
+    rng = np.random.default_rng(seed)
+    wins = np.zeros((len(scales), len(num_tags), num_points), dtype=np.int64)
+    for start in range(0, iterations, BATCH_SIZE):
+        batch = min(BATCH_SIZE, iterations - start)
+        keys = rng.standard_exponential((batch, len(points))) / weights
+
+        for s in range(len(scales)):
+            # applicants outside this scaling never draw
+            scale_keys = np.where(in_scale[s], keys, np.inf)
+            drawn = min(max_tags, len(points))
+            order = lowest_keys(scale_keys, drawn)
+            drawn_points = np.where(np.isfinite(np.take_along_axis(scale_keys, order, axis=1)), points[order],
+                                    num_points)
+
+            # tags drawn by each point category at each place in the draw order, totalled over the batch (the extra
+            # column is for places past the last applicant), then counted up to every number of tags
+            places = np.arange(drawn) * (num_points + 1) + drawn_points
+            by_place = np.bincount(places.ravel(), minlength=drawn * (num_points + 1)).reshape(drawn, num_points + 1)
+            drawn_by = np.zeros((drawn + 1, num_points), dtype=np.int64)
+            drawn_by[1:] = np.cumsum(by_place[:, :num_points], axis=0)
+            wins[s] += drawn_by[np.minimum(num_tags, drawn)]
+
+    ratio = np.divide(wins, applicants[:, None, :] * iterations, out=np.zeros(wins.shape),
+                      where=applicants[:, None, :] > 0)
+    return applicants, wins, np.round(ratio * 100, 1)
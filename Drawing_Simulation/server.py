@@ -1,22 +1,99 @@
 import DrawSimul as ds 
 import flask
+import numpy as np
+import os
+import sys
+import Metrics
+
+# the profiler is shared with the Queries server
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Queries'))
+import Profiling
+import StatewideSimul
+import SweepSimul
 
 # initialize the app
 app = flask.Flask(__name__)
+Profiling.install(app)
 
 # define constants 
 NUM_DWGS = 10
+STATEWIDE_DWGS = 100
+SWEEP_DWGS = 1000
+
+# most statewide iterations one request may ask for (a statewide drawing takes ~10ms, and a request has to finish well
+# inside the gunicorn worker timeout)
+MAX_STATEWIDE_DWGS = 2000
+
+# routes left out of the request metrics (scrapes and health checks)
+UNTIMED_ENDPOINTS = ('get_metrics', 'get_health', 'get_readiness')
+
+# set once warm_up has run
+ready = False
+
+
+def warm_up():
+    """Runs a small simulation of each kind so the first requests don't pay for imports and first calls"""
+    global ready
+    expected_apps = [2, 1] + [0] * 19
+    ds.simulate_odds(expected_apps, 'warm up', 1, 1)
+    pool = StatewideSimul.ApplicantPool.from_tag_counts(np.array([expected_apps]))
+    StatewideSimul.StatewideDrawing(pool, [1]).run(1, 1)
+    SweepSimul.sweep_odds(expected_apps, [1], [1.0], 1)
+    ready = True
+
+
+def is_count(value):
+    """True for a whole number that is not negative"""
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+def is_amount(value):
+    """True for a number that is not negative"""
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0
+
+
+def statewide_tag_error(tag):
+    """Returns what is wrong with a tag of a statewide request, or None"""
+    if not isinstance(tag, dict) or "tag" not in tag:
+        return "every tag needs a \"tag\" name"
+    if not isinstance(tag.get("calculated"), list) or not all(is_amount(apps) for apps in tag["calculated"]):
+        return f"{tag['tag']}: calculated must be a list of applicants that are not negative"
+    if not is_count(tag.get("num tags")):
+        return f"{tag['tag']}: num tags must be a whole number that is not negative"
+    second_choices = tag.get("second choices", {})
+    if not isinstance(second_choices, dict) or not all(is_amount(fraction) for fraction in second_choices.values()):
+        return f"{tag['tag']}: second choices must map tags to fractions that are not negative"
+    return None
+
+
+# start timing every request except metrics scrapes and health checks
+@app.before_request
+def before_request():
+    if flask.request.url_rule is not None and flask.request.endpoint not in UNTIMED_ENDPOINTS:
+        Metrics.start_request(flask.request.url_rule.rule)
+
 
 # define CORS policy
 @app.after_request
 def after_request(response):
     header = response.headers
     header['Access-Control-Allow-Origin'] = '*'
+
+    stats = Metrics.end_request()
+    if stats is not None:
+        header['Server-Timing'] = stats.server_timing()
     return response
 
 
+@app.teardown_request
+def teardown_request(exc):
+    Metrics.end_request()
+
+
 # define routes
 @app.route('/predictions', methods=["OPTIONS"])
+@app.route('/statewide_predictions', methods=["OPTIONS"])
+@app.route('/predictions/sweep', methods=["OPTIONS"])
 def cors_preflight():
     res = flask.Response()
     res.access_control_allow_headers = '*'
@@ -32,35 +109,126 @@ def get_point_predictions():
     num_tags = request_data["num tags"]
     tag_id = request_data["tag"]
 
-    # generate 10 drawing simulation objects to run the drawing 10 times
-    all_simulations = []
-    for _ in range(NUM_DWGS):
-        simulation = ds.DrawSimul(next_year_apps, tag_id, num_tags)
-        all_simulations.append(simulation)
-
-    # loop through and run drawing simulation for each simulation object, replacing the simulation object with the result
-    for i, sim in enumerate(all_simulations):
-        all_simulations[i] = sim.run_drawing()
-    
-    # loop through results and add them all together
-    total_results = [0 for _ in all_simulations[0]]
-    for index in range(len(total_results)):
-        for iteration in range(len(all_simulations)):
-            total_results[index] += all_simulations[iteration][index]
-    
-    # calculate % chance of drawing
-    perc_chance_of_success = []
-    for i, result in enumerate(total_results):
-        if next_year_apps[i] == 0:
-            perc_chance = 0
-        else:
-            perc_chance = round((result / (next_year_apps[i] * 10)) * 100, 1)
-
-        perc_chance_of_success.append(perc_chance)
-        request_data["total tags obtained"] = total_results
-        request_data["calculated success perc"] = perc_chance_of_success
+    # run the drawing 10 times, totalling the tags obtained by each point category and the % chance of drawing
+    with Metrics.simulation_timer():
+        total_results, perc_chance_of_success = ds.simulate_odds(next_year_apps, tag_id, num_tags, NUM_DWGS)
+
+    request_data["total tags obtained"] = total_results
+    request_data["calculated success perc"] = perc_chance_of_success
 
     return flask.json.jsonify(request_data)
 
 
-app.run(debug=True, host='localhost', port=58555)
+@app.route('/statewide_predictions', methods=["POST"])
+def get_statewide_predictions():
+
+    # body holds every tag of the species/year: {"tags": [{"tag", "calculated", "num tags", "second choices"}]} where
+    # "second choices" (optional) maps other tags to the fraction of this tag's applicants listing them second
+    request_data = flask.request.get_json(silent=True)
+    if not isinstance(request_data, dict) or not isinstance(request_data.get("tags"), list):
+        return {"error": "tags must be a list"}, 400
+    tags = request_data["tags"]
+    iterations = request_data.get("iterations", STATEWIDE_DWGS)
+    if not is_count(iterations) or not 1 <= iterations <= MAX_STATEWIDE_DWGS:
+        return {"error": f"iterations must be a whole number from 1 to {MAX_STATEWIDE_DWGS}"}, 400
+    for tag in tags:
+        error = statewide_tag_error(tag)
+        if error is not None:
+            return {"error": error}, 400
+
+    tag_pos = {tag["tag"]: i for i, tag in enumerate(tags)}
+
+    num_points = max(len(tag["calculated"]) for tag in tags) if tags else 0
+    tag_apps = np.zeros((len(tags), num_points), dtype=np.int64)
+    for i, tag in enumerate(tags):
+        tag_apps[i, :len(tag["calculated"])] = tag["calculated"]
+    second_choices = {i: {tag_pos[other]: fraction for other, fraction in tag.get("second choices", {}).items()
+                          if other in tag_pos}
+                      for i, tag in enumerate(tags)}
+
+    with Metrics.simulation_timer():
+        pool = StatewideSimul.ApplicantPool.from_tag_counts(tag_apps, second_choices)
+        drawing = StatewideSimul.StatewideDrawing(pool, [tag["num tags"] for tag in tags])
+        # run in this process - forking a worker pool per request from a threaded server is fragile, and with
+        # gunicorn the cores are already used by the server's own workers (offline callers can pass workers to run)
+        results = drawing.run(iterations, 1)
+
+    first_perc = results.first_choice_perc()
+    second_perc = results.second_choice_perc()
+    for i, tag in enumerate(tags):
+        tag["first choice success perc"] = first_perc[i, :num_points].tolist()
+        tag["second choice success perc"] = second_perc[i, :num_points].tolist()
+    request_data["iterations"] = iterations
+
+    return flask.json.jsonify(request_data)
+
+
+@app.route('/predictions/sweep', methods=["POST"])
+def get_sweep_predictions():
+
+    # body holds the forecast applicants ("calculated"), the numbers of tags to try - a list or a range
+    # {"start", "stop", "step"} (stop included) - and the factors to scale the applicants by ("scales", default [1])
+    request_data = flask.request.get_json(silent=True)
+    if not isinstance(request_data, dict):
+        return {"error": "the body must be a json object"}, 400
+    num_tags = request_data.get("num tags")
+    if isinstance(num_tags, dict):
+        step = num_tags.get("step", 1)
+        if not all(is_count(num_tags.get(key)) for key in ("start", "stop")) or not is_count(step) or step < 1:
+            return {"error": "a num tags range needs start and stop (not negative) and a step of at least 1"}, 400
+        num_tags = list(range(num_tags["start"], num_tags["stop"] + 1, step))
+    # a single number of tags or scale (as /predictions takes) is a list of one
+    elif not isinstance(num_tags, list):
+        num_tags = [num_tags]
+    scales = request_data.get("scales", [1.0])
+    if not isinstance(scales, list):
+        scales = [scales]
+    calculated = request_data.get("calculated")
+    iterations = request_data.get("iterations", SWEEP_DWGS)
+    if not num_tags or not scales:
+        return {"error": "num tags and scales must not be empty"}, 400
+    if not all(is_count(tags) for tags in num_tags):
+        return {"error": "num tags must be whole numbers that are not negative"}, 400
+    if not all(is_amount(scale) for scale in scales):
+        return {"error": "scales must be numbers that are not negative"}, 400
+    if not isinstance(calculated, list) or not all(is_amount(apps) for apps in calculated):
+        return {"error": "calculated must be a list of applicants that are not negative"}, 400
+    if not is_count(iterations) or iterations < 1:
+        return {"error": "iterations must be a whole number of at least 1"}, 400
+
+    with Metrics.simulation_timer():
+        applicants, wins, perc = SweepSimul.sweep_odds(calculated, num_tags, scales, iterations)
+
+    # one surface (scales x num tags) per point category
+    request_data["num tags"] = num_tags
+    request_data["scales"] = scales
+    request_data["iterations"] = iterations
+    request_data["scaled apps"] = applicants.tolist()
+    request_data["success perc"] = perc.transpose(2, 0, 1).tolist()
+
+    return flask.json.jsonify(request_data)
+
+
+@app.route('/metrics')
+def get_metrics():
+    return flask.Response(Metrics.render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/healthz')
+def get_health():
+    """Liveness - the process is up and serving requests"""
+    return {'status': 'ok'}
+
+
+@app.route('/readyz')
+def get_readiness():
+    """Readiness - warm_up has run"""
+    if not ready:
+        return {'status': 'warming up'}, 503
+    return {'status': 'ready'}
+
+
+if __name__ == '__main__':
+    warm_up()
+    # the flask debugger is only turned on with FLASK_DEBUG=1
+    app.run(debug=os.getenv('FLASK_DEBUG') == '1', host='localhost', port=58555)
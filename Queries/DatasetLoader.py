@@ -0,0 +1,62 @@
+# This file defines the loader used to keep data derived from the drawing results collection (the stats cube, the tag
+# index) in memory and to rebuild it when the collection changes, e.g. after a new year has been ingested.
+import threading
+import time
+import pymongo
+
+
+def dataset_generation(collection: pymongo.collection.Collection):
+    """Returns a value that changes whenever documents are added to or removed from the collection (the document count
+    together with the newest object id)."""
+    newest = collection.find_one({}, projection={'_id': 1}, sort=[('_id', pymongo.DESCENDING)])
+    newest_id = None if newest is None else str(newest['_id'])
+    return collection.estimated_document_count(), newest_id
+
+
+class DatasetLoader:
+    """Holds the current object built from the collection by build (which must give the object a generation
+    attribute matching what the generation function returns). The collection's generation is checked at most once
+    every refresh_interval seconds and, when it has changed, a new object is built and swapped in. Requests that already
+    have the old object keep using it, so every request sees a single consistent snapshot."""
+
+    def __init__(self, doc_collection: pymongo.collection.Collection, build, refresh_interval: float = 60,
+                 generation=dataset_generation):
+        self.doc_coll = doc_collection
+        self.build = build
+        self.refresh_interval = refresh_interval
+        self.generation = generation
+        self._current = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        """True once an object has been built"""
+        return self._current is not None
+
+    def load(self):
+        """Builds a new object from the collection and swaps it in"""
+        current = self.build(self.doc_coll)
+        self._current = current
+        self._checked_at = time.monotonic()
+        return current
+
+    def get(self):
+        """Returns the current object, rebuilding it first if the dataset has changed"""
+        current = self._current
+        if current is not None and time.monotonic() - self._checked_at < self.refresh_interval:
+            return current
+
+        # only one thread checks / rebuilds, everyone else keeps serving the object they already have
+        if not self._lock.acquire(blocking=current is None):
+            return current
+        try:
+            if self._current is None:
+                return self.load()
+            if time.monotonic() - self._checked_at >= self.refresh_interval:
+                self._checked_at = time.monotonic()
+                if self.generation(self.doc_coll) != self._current.generation:
+                    return self.load()
+            return self._current
+        finally:
+            self._lock.release()
@@ -7,7 +7,7 @@ num_years = 5
 class DistObject:
 
     def __init__(self, doc_collection: pymongo.collection.Collection, species: str, residency: str, district: str,
-                 end_year: int, query_data=True):
+                 end_year: int, query_data=True, stats_cube=None):
         self.start = end_year - num_years + 1
         self.end = end_year
         self.years = [num for num in range(self.start, self.end + 1)]
@@ -16,6 +16,7 @@ class DistObject:
         self.species = species.upper()
         self.residency = residency.upper()
         self.year_stats = None
+        self.stats_cube = stats_cube
 
         if query_data:
             self.year_stats = [YearStat.YearStat(year) for year in self.years]
@@ -46,7 +47,11 @@ class DistObject:
             }
         ]
 
-        results = self.doc_coll.aggregate(pipeline)
+        if self.stats_cube is not None:
+            results = self.stats_cube.year_stats(self.species, self.residency, self.start, self.end,
+                                                 district=self.district)
+        else:
+            results = self.doc_coll.aggregate(pipeline, comment=self.__class__.__name__)
 
         # loop through results, assigning values to YearStat objects
         for stat in results:
@@ -58,12 +63,17 @@ class DistObject:
             yr_stat_obj.set_perc_success()
             yr_stat_obj.set_avg_pts_per_app(stat['sum_wa_pts'])       
 
-    def get_tags(self):
-        """This function gets the tags within the district passed in as an argument"""
+    def get_tags(self, after: str = None, limit: int = None):
+        """This function gets the tags within the district passed in as an argument. Tags are sorted by tag number, so
+        passing the last tag of a page as "after" (and a page size as "limit") pages through the district."""
+        match = {'residency': self.residency, 'species': self.species, 'district': self.district,
+                 'dwg_year': {'$gte': self.start, '$lte': self.end}}
+        if after is not None:
+            match['tag_num'] = {'$gt': after}
+
         pipeline = [
             {
-                '$match': {'residency': self.residency, 'species': self.species, 'district': self.district,
-                           'dwg_year': {'$gte': self.start, '$lte': self.end}}
+                '$match': match
             },
             {
                 '$group': {'_id': {'tag num': '$tag_num'}}
@@ -72,7 +82,14 @@ class DistObject:
                 '$sort': {'_id': pymongo.ASCENDING}
             }
         ]
-        results = self.doc_coll.aggregate(pipeline)
+        if limit is not None:
+            pipeline.append({'$limit': limit})
+
+        if self.stats_cube is not None:
+            return self.stats_cube.district_tags(self.species, self.residency, self.district, self.start, self.end,
+                                                 after, limit)
+
+        results = self.doc_coll.aggregate(pipeline, comment=self.__class__.__name__)
         return list(results)
 
     def get_stats_dict_format(self, stat_list):
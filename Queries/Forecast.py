@@ -0,0 +1,100 @@
+# This file forecasts next year's applicants for each point category of every tag at once, in place of the external
+# forecast service on port 58585.
+#
+# The model follows point creep: an applicant who is unsuccessful this year comes back next year one point category
+# higher (the top category keeps its unsuccessful applicants). How many of them actually come back is learned per tag
+# and point category from the history as a retention ratio (applicants in category p+1 next year / unsuccessful in
+# category p this year). The 0 point category is made up of new applicants, so it is forecast with a linear trend.
+import threading
+import numpy as np
+
+# retention ratios are kept inside these bounds so one odd year can't blow up the forecast
+MIN_RETENTION = 0.0
+MAX_RETENTION = 3.0
+
+
+def carried_applicants(applicants: np.ndarray, successes: np.ndarray):
+    """Shifts each year's unsuccessful applicants up one point category. Arrays are (..., points)."""
+    unsuccessful = np.clip(applicants - successes, 0, None)
+    carried = np.zeros_like(unsuccessful)
+    carried[..., 1:] = unsuccessful[..., :-1]
+    carried[..., -1] += unsuccessful[..., -1]
+    return carried
+
+
+def linear_trend(values: np.ndarray):
+    """Fits a least squares line to each row of values (rows are series, columns are years) and returns the value of
+    each line one year past the end"""
+    num_years = values.shape[-1]
+    if num_years < 2:
+        return values[..., -1].astype(float)
+
+    years = np.arange(num_years, dtype=float)
+    centered = years - years.mean()
+    slope = (values * centered).sum(axis=-1) / (centered ** 2).sum()
+    intercept = values.mean(axis=-1) - slope * years.mean()
+    return intercept + slope * num_years
+
+
+def forecast_applicants(applicants: np.ndarray, successes: np.ndarray):
+    """Takes (tags, years, points) arrays of applicants and successes, oldest year first, and returns a (tags, points)
+    array with the forecast applicants for the year after the last one."""
+    applicants = applicants.astype(float)
+    successes = successes.astype(float)
+    carried = carried_applicants(applicants, successes)
+
+    # retention ratio of every tag/point category over all the year -> next year pairs in the history. Where a tag
+    # has nothing carried into a category, fall back to the ratio of all the tags together, then to 1.
+    returned = applicants[:, 1:].sum(axis=1)
+    eligible = carried[:, :-1].sum(axis=1)
+    overall = np.divide(returned.sum(axis=0), eligible.sum(axis=0), out=np.ones(returned.shape[1]),
+                        where=eligible.sum(axis=0) > 0)
+    retention = np.divide(returned, eligible, out=np.broadcast_to(overall, returned.shape).copy(), where=eligible > 0)
+    retention = np.clip(retention, MIN_RETENTION, MAX_RETENTION)
+
+    forecast = retention * carried[:, -1]
+    forecast[:, 0] = np.clip(linear_trend(applicants[:, :, 0]), 0, None)
+    return np.rint(forecast).astype(np.int64)
+
+
+class ForecastEngine:
+    """Serves forecasts for single tags out of batch forecasts of every tag of a species/residency. The batches are
+    computed from a StatsCube (taken from cube_loader, a DatasetLoader) and thrown away when the cube changes."""
+
+    def __init__(self, cube_loader):
+        self.cube_loader = cube_loader
+        self._cube = None
+        self._batches = {}
+        self._lock = threading.Lock()
+
+    def forecast_all(self, species: str, residency: str, start: int, end: int):
+        """Returns ({tag: forecast list}, cube) for every tag of the species/residency, using the years start - end as
+        the history"""
+        cube = self.cube_loader.get()
+        key = (species, residency, start, end)
+        with self._lock:
+            if cube is not self._cube:
+                self._cube = cube
+                self._batches = {}
+            if key in self._batches:
+                return self._batches[key], cube
+
+        forecasts = {}
+        block = cube.blocks.get((species, residency))
+        if block is not None:
+            _, years = block.year_slice(start, end)
+            if years.stop > years.start:
+                next_years_apps = forecast_applicants(block.applicants[:, years], block.successes[:, years])
+                forecasts = {tag: next_years_apps[i].tolist() for i, tag in enumerate(block.tags)}
+
+        with self._lock:
+            if cube is self._cube:
+                self._batches[key] = forecasts
+        return forecasts, cube
+
+    def predict(self, species: str, residency: str, tag: str, start: int, end: int):
+        """Returns the forecast applicants for each point category of a tag (all zeros if there is no history)"""
+        forecasts, cube = self.forecast_all(species, residency, start, end)
+        block = cube.blocks.get((species, residency))
+        num_points = 21 if block is None else len(block.point_vals)
+        return forecasts.get(tag, [0] * num_points)
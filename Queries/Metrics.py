@@ -0,0 +1,130 @@
+# This file contains the instrumentation used by the Queries server. It counts and times every aggregation sent to mongo
+# during a request (via pymongo command monitoring), times the forecast call and the dict conversion, and keeps
+# prometheus style histograms of everything for the /metrics endpoint.
+import threading
+import time
+from contextlib import contextmanager
+from pymongo import monitoring
+import RequestMetrics
+from RequestMetrics import Histogram
+
+# bucket upper bounds for the number of aggregations run in one request
+COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# mongo commands that make up an aggregation (the first batch comes back with the aggregate, the rest with getMore)
+AGGREGATION_COMMANDS = ('aggregate', 'getMore')
+
+REQUEST_DURATION = Histogram('queries_request_duration_seconds', 'Total time spent handling a request.', ('route',))
+AGGREGATION_DURATION = Histogram('queries_aggregation_duration_seconds',
+                                 'Client observed round trip time of each aggregation command (aggregate and '
+                                 'getMore).',
+                                 ('route', 'query_class'))
+AGGREGATIONS_PER_REQUEST = Histogram('queries_aggregations_per_request', 'Number of aggregations run by a request.',
+                                     ('route',), COUNT_BUCKETS)
+SECTION_DURATION = Histogram('queries_section_duration_seconds',
+                             'Time spent in timed sections of a request (forecast, serialize).',
+                             ('route', 'section', 'query_class'))
+
+ALL_HISTOGRAMS = [REQUEST_DURATION, AGGREGATION_DURATION, AGGREGATIONS_PER_REQUEST, SECTION_DURATION]
+
+
+class RequestStats(RequestMetrics.RequestStats):
+    """Holds the timings collected while a single request is being handled, including its mongo commands."""
+
+    def __init__(self, route: str):
+        super().__init__(route)
+        self.aggregations = 0
+        self.mongo_time = 0
+
+    def add_command(self, command_name: str, query_class: str, duration: float):
+        if command_name == 'aggregate':
+            self.aggregations += 1
+        self.mongo_time += duration
+        AGGREGATION_DURATION.observe(duration, route=self.route, query_class=query_class)
+
+    def add_section(self, section: str, duration: float, query_class: str = ''):
+        super().add_section(section, duration)
+        SECTION_DURATION.observe(duration, route=self.route, section=section, query_class=query_class)
+
+    def timing_entries(self):
+        mongo = f'mongo;dur={self.mongo_time * 1000:.1f};desc="{self.aggregations} aggregations"'
+        return [mongo] + super().timing_entries()
+
+
+# pymongo publishes command events on the thread that issued the command, so the listener finds the request's stats in
+# the same thread local
+_current = RequestMetrics.CurrentRequest()
+
+
+def start_request(route: str):
+    stats = RequestStats(route)
+    _current.set(stats)
+    return stats
+
+
+def current_request():
+    return _current.get()
+
+
+def detach_request():
+    """Removes the stats for the current request from this thread without recording them. Used by streamed responses,
+    which keep running queries after the request handler has returned."""
+    return _current.pop()
+
+
+def resume_request(stats):
+    _current.set(stats)
+
+
+def end_request():
+    """Records the request level histograms and returns the stats for the request that just finished"""
+    stats = _current.pop()
+    if stats is not None:
+        REQUEST_DURATION.observe(time.perf_counter() - stats.start, route=stats.route)
+        AGGREGATIONS_PER_REQUEST.observe(stats.aggregations, route=stats.route)
+    return stats
+
+
+@contextmanager
+def timer(section: str, query_class: str = ''):
+    """Times the body of the with statement and adds it to the current request under the given section name"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = current_request()
+        if stats is not None:
+            stats.add_section(section, time.perf_counter() - start, query_class)
+
+
+def render_metrics():
+    return RequestMetrics.render_histograms(ALL_HISTOGRAMS)
+
+
+class QueryListener(monitoring.CommandListener):
+    """Command listener that adds every aggregation command to the stats of the request that issued it. The query
+    objects pass their class name as the aggregation comment, which is how the commands get labelled by class."""
+
+    def __init__(self):
+        self._labels = threading.local()
+
+    def _pending(self):
+        if not hasattr(self._labels, 'pending'):
+            self._labels.pending = {}
+        return self._labels.pending
+
+    def started(self, event):
+        if event.command_name in AGGREGATION_COMMANDS and current_request() is not None:
+            self._pending()[event.request_id] = str(event.command.get('comment', 'unknown'))
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+    def _finish(self, event):
+        query_class = self._pending().pop(event.request_id, None)
+        stats = current_request()
+        if query_class is not None and stats is not None:
+            stats.add_command(event.command_name, query_class, event.duration_micros / 1e6)
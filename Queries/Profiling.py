@@ -0,0 +1,106 @@
+# This file contains the opt-in request profiler used by both the Queries and the drawing simulation servers. When
+# PROFILE_DIR is set the app is wrapped in a WSGI middleware that runs cProfile over selected requests (the handler, the
+# queries or simulations it runs and writing out the response) and saves each profile to PROFILE_DIR as a .prof file
+# (pstats format - view it as a flame graph with e.g. snakeviz or flameprof).
+#
+# A request is profiled when it has an X-Profile header or is picked by the PROFILE_SAMPLE_RATE sampling, at most
+# PROFILE_MAX_PER_MINUTE times a minute and one at a time. When PROFILE_DIR is not set the app is left untouched.
+import cProfile
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+
+
+class ProfilingMiddleware:
+    """WSGI middleware that profiles the requests picked by should_profile and writes the profiles to profile_dir"""
+
+    def __init__(self, wsgi_app, profile_dir: str, sample_rate: float = 0.0, max_per_minute: int = 10):
+        self.wsgi_app = wsgi_app
+        self.profile_dir = profile_dir
+        self.sample_rate = sample_rate
+        self.max_per_minute = max_per_minute
+        self._recent = deque()
+        self._recent_lock = threading.Lock()
+        # only one profiler can run at a time
+        self._active = threading.Lock()
+        os.makedirs(profile_dir, exist_ok=True)
+
+    def should_profile(self, environ: dict):
+        """True if the request asked to be profiled (or was sampled) and the rate limit allows another profile"""
+        if not environ.get(PROFILE_HEADER) and random.random() >= self.sample_rate:
+            return False
+
+        now = time.monotonic()
+        with self._recent_lock:
+            while self._recent and now - self._recent[0] > 60:
+                self._recent.popleft()
+            if len(self._recent) >= self.max_per_minute:
+                return False
+            self._recent.append(now)
+        return True
+
+    def profile_path(self, environ: dict):
+        route = re.sub(r'[^A-Za-z0-9]+', '_', environ.get('PATH_INFO', '')).strip('_') or 'root'
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 10**9:09d}-{environ.get('REQUEST_METHOD')}-{route}"
+        return os.path.join(self.profile_dir, name[:200] + '.prof')
+
+    def __call__(self, environ: dict, start_response):
+        if not self.should_profile(environ) or not self._active.acquire(blocking=False):
+            return self.wsgi_app(environ, start_response)
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            try:
+                body = self.wsgi_app(environ, start_response)
+            finally:
+                profiler.disable()
+        except BaseException:
+            self._active.release()
+            raise
+        return ProfiledBody(body, profiler, self.profile_path(environ), self._active)
+
+
+class ProfiledBody:
+    """Response body that keeps profiling while the server reads it (streamed responses run their queries as they are
+    read). The profile is written when the server closes the body."""
+
+    def __init__(self, body, profiler: cProfile.Profile, path: str, active: threading.Lock):
+        self.body = body
+        self.profiler = profiler
+        self.path = path
+        self.active = active
+        self._iterator = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.profiler.enable()
+        try:
+            if self._iterator is None:
+                self._iterator = iter(self.body)
+            return next(self._iterator)
+        finally:
+            self.profiler.disable()
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.profiler.dump_stats(self.path)
+            self.active.release()
+
+
+def install(app):
+    """Wraps the flask app in the profiling middleware if PROFILE_DIR is set"""
+    profile_dir = os.getenv('PROFILE_DIR')
+    if profile_dir:
+        app.wsgi_app = ProfilingMiddleware(app.wsgi_app, profile_dir, float(os.getenv('PROFILE_SAMPLE_RATE', '0')),
+                                           int(os.getenv('PROFILE_MAX_PER_MINUTE', '10')))
@@ -0,0 +1,92 @@
+# This file defines the statewide ranking index. For every species/residency/point category it keeps the tags sorted by
+# success percentage (historical, from the drawing results, and predicted, from the precomputed draw odds), statewide
+# and per region, so "best odds for a 6 point nonresident" is a slice of a list rather than a scan of every tag.
+import heapq
+from itertools import islice
+import numpy as np
+
+BASES = ('historical', 'predicted')
+
+
+class RankedTag:
+    """One tag's success percentage at a point category."""
+
+    def __init__(self, tag: str, district: str, region: str, perc_success: float, applicants: int, successes=None):
+        self.tag = tag
+        self.district = district
+        self.region = region
+        self.perc_success = perc_success
+        self.applicants = applicants
+        self.successes = successes
+
+    def sort_key(self):
+        return -self.perc_success, self.tag
+
+    def convert_to_dict(self):
+        return {
+            'tag': self.tag,
+            'district': self.district,
+            'region': self.region,
+            '% success': self.perc_success,
+            'applicants': self.applicants,
+            'successes': self.successes,
+        }
+
+
+class RankingIndex:
+    """Sorted rankings keyed by (species, residency, points, basis). Each key holds the statewide list and one list per
+    region."""
+
+    def __init__(self, rankings: dict, generation=None):
+        self.generation = generation
+        self._statewide = {}
+        self._regions = {}
+        for key, ranked in rankings.items():
+            ranked = sorted(ranked, key=RankedTag.sort_key)
+            self._statewide[key] = ranked
+            by_region = {}
+            for entry in ranked:
+                by_region.setdefault(entry.region, []).append(entry)
+            self._regions[key] = by_region
+
+    @classmethod
+    def build(cls, cube, odds_docs, start: int, end: int, generation=None):
+        """Builds the historical rankings from a StatsCube (success % over the years start - end) and the predicted
+        rankings from the draw_odds documents written by precompute_odds.py"""
+        rankings = {}
+        for (species, residency), block in cube.blocks.items():
+            _, years = block.year_slice(start, end)
+            applicants = block.applicants[:, years].sum(axis=1)
+            successes = block.successes[:, years].sum(axis=1)
+            ratio = np.divide(successes, applicants, out=np.zeros(applicants.shape), where=applicants > 0)
+            perc = np.round(ratio * 100, 1)
+
+            for points in range(applicants.shape[1]):
+                drawn = np.flatnonzero(applicants[:, points])
+                rankings[(species, residency, points, 'historical')] = [
+                    RankedTag(block.tags[i], block.districts[i], block.regions[i], float(perc[i, points]),
+                              int(applicants[i, points]), int(successes[i, points]))
+                    for i in drawn]
+
+        for doc in odds_docs:
+            block = cube.blocks.get((doc['species'], doc['residency']))
+            if block is None or doc['tag_num'] not in block.tag_pos:
+                continue
+            tag_pos = block.tag_pos[doc['tag_num']]
+            for points, perc_success in enumerate(doc['calculated success perc']):
+                if doc['calculated'][points] > 0:
+                    ranked = rankings.setdefault((doc['species'], doc['residency'], points, 'predicted'), [])
+                    ranked.append(RankedTag(doc['tag_num'], block.districts[tag_pos], block.regions[tag_pos],
+                                            perc_success, doc['calculated'][points]))
+
+        return cls(rankings, generation)
+
+    def top(self, species: str, residency: str, points: int, basis: str = 'historical', n: int = 10, regions=None):
+        """Returns the n tags with the best success % for the point category, optionally only within the regions"""
+        key = (species, residency, points, basis)
+        if not regions:
+            return self._statewide.get(key, [])[:n]
+
+        by_region = self._regions.get(key, {})
+        region_lists = [by_region.get(region, []) for region in set(regions)]
+        return list(islice(heapq.merge(*region_lists, key=RankedTag.sort_key), n))
@@ -7,7 +7,7 @@ num_years = 5
 class RegionsObject:
 
     def __init__(self, residency: str, species: str, doc_collection: pymongo.collection.Collection,
-                 end_year: int, region: int, query_data=True):
+                 end_year: int, region: int, query_data=True, stats_cube=None):
         self.residency = residency.upper()
         self.species = species.upper()
         self.doc_coll = doc_collection
@@ -16,6 +16,7 @@ class RegionsObject:
         self.end = end_year
         self.years = [num for num in range(self.start, self.end + 1)]
         self.year_stats = None
+        self.stats_cube = stats_cube
 
         if query_data:
             self.year_stats = [YearStat.YearStat(year) for year in self.years]
@@ -45,7 +46,11 @@ class RegionsObject:
             }
         ]
 
-        results = self.doc_coll.aggregate(pipeline)
+        if self.stats_cube is not None:
+            results = self.stats_cube.year_stats(self.species, self.residency, self.start, self.end,
+                                                 region=self.region)
+        else:
+            results = self.doc_coll.aggregate(pipeline, comment=self.__class__.__name__)
 
         # loop through results, assigning values to YearStat objects
         for stat in results:
@@ -71,7 +76,10 @@ class RegionsObject:
                 '$sort': {'_id': pymongo.ASCENDING}
             }
         ]
-        results = self.doc_coll.aggregate(pipeline)
+        if self.stats_cube is not None:
+            return self.stats_cube.region_districts(self.species, self.residency, self.region, self.start, self.end)
+
+        results = self.doc_coll.aggregate(pipeline, comment=self.__class__.__name__)
         return list(results)
 
     def get_stats_dict_format(self, stat_list):
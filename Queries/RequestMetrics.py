@@ -0,0 +1,178 @@
+# This file contains the pieces of request instrumentation shared by the Queries and drawing simulation servers: prometheus
+# style histograms and their text exposition, the timings of a single request (sent back in the Server-Timing header)
+# and the thread local that holds them while the request is handled. Each server's Metrics.py defines its own
+# histograms on top of these.
+#
+# Under gunicorn every worker process keeps its own histograms, and a scrape reaches whichever worker is free. With
+# WORKER_METRICS_DIR set (gunicorn.conf.py sets it) each worker saves its histograms to a file there every
+# SAVE_INTERVAL seconds, and /metrics adds up the files of all the workers, including ones that have exited, so the
+# totals only ever go up.
+import json
+import os
+import threading
+import time
+
+# bucket upper bounds (seconds) for the duration histograms
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+WORKER_METRICS_DIR = os.getenv('WORKER_METRICS_DIR')
+SAVE_INTERVAL = 5
+
+# every histogram of this process, saved together into its worker metrics file
+_histograms = []
+_saver_lock = threading.Lock()
+_saver_started = False
+
+
+class Histogram:
+    """A prometheus style histogram with labels. Observations are thread safe."""
+
+    def __init__(self, name: str, description: str, label_names: tuple, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+        _histograms.append(self)
+
+    def observe(self, value, **labels):
+        if WORKER_METRICS_DIR and not _saver_started:
+            _start_saver()
+        key = tuple(str(labels.get(label, '')) for label in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'counts': [0] * len(self.buckets), 'sum': 0, 'count': 0}
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def series(self):
+        """Returns a copy of the series as [[label values], {'counts', 'sum', 'count'}] pairs (json friendly)"""
+        with self._lock:
+            return [[list(key), {'counts': list(series['counts']), 'sum': series['sum'], 'count': series['count']}]
+                    for key, series in self._series.items()]
+
+    def render(self, all_series: dict = None):
+        """Returns the histogram as a list of lines in the prometheus text exposition format. all_series replaces this
+        process's series (see merged_series)."""
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        if all_series is None:
+            all_series = {tuple(key): series for key, series in self.series()}
+        for key, series in sorted(all_series.items()):
+            labels = [f'{name}="{value}"' for name, value in zip(self.label_names, key)]
+            for bound, count in zip(self.buckets, series['counts']):
+                bucket_labels = ','.join(labels + [f'le="{bound}"'])
+                lines.append(f'{self.name}_bucket{{{bucket_labels}}} {count}')
+            inf_labels = ','.join(labels + ['le="+Inf"'])
+            lines.append(f'{self.name}_bucket{{{inf_labels}}} {series["count"]}')
+            lines.append(f'{self.name}_sum{{{",".join(labels)}}} {series["sum"]}')
+            lines.append(f'{self.name}_count{{{",".join(labels)}}} {series["count"]}')
+        return lines
+
+
+def save_worker_metrics():
+    """Writes this process's histograms to its file in WORKER_METRICS_DIR"""
+    path = os.path.join(WORKER_METRICS_DIR, f'{os.getpid()}.json')
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w') as metrics_file:
+        json.dump({histogram.name: histogram.series() for histogram in _histograms}, metrics_file)
+    os.replace(temp_path, path)
+
+
+def _save_loop():
+    while True:
+        time.sleep(SAVE_INTERVAL)
+        try:
+            save_worker_metrics()
+        except OSError:
+            pass
+
+
+def _start_saver():
+    # started by the first observation, so it runs in the worker process rather than a process that forks workers
+    global _saver_started
+    with _saver_lock:
+        if not _saver_started:
+            threading.Thread(target=_save_loop, daemon=True).start()
+            _saver_started = True
+
+
+def merged_series():
+    """Adds up the worker metrics files. Returns {histogram name: {label values: series}}."""
+    merged = {}
+    for file_name in os.listdir(WORKER_METRICS_DIR):
+        if not file_name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(WORKER_METRICS_DIR, file_name)) as metrics_file:
+                worker = json.load(metrics_file)
+        except (OSError, ValueError):
+            continue
+        for name, all_series in worker.items():
+            totals = merged.setdefault(name, {})
+            for key, series in all_series:
+                total = totals.get(tuple(key))
+                if total is None:
+                    totals[tuple(key)] = series
+                else:
+                    total['counts'] = [a + b for a, b in zip(total['counts'], series['counts'])]
+                    total['sum'] += series['sum']
+                    total['count'] += series['count']
+    return merged
+
+
+def render_histograms(histograms: list):
+    """Returns the body of a /metrics response, the totals of every worker when WORKER_METRICS_DIR is set"""
+    merged = None
+    if WORKER_METRICS_DIR:
+        save_worker_metrics()
+        merged = merged_series()
+
+    lines = []
+    for histogram in histograms:
+        lines.extend(histogram.render(None if merged is None else merged.get(histogram.name, {})))
+    return '\n'.join(lines) + '\n'
+
+
+class RequestStats:
+    """Holds the timings collected while a single request is being handled."""
+
+    def __init__(self, route: str):
+        self.route = route
+        self.start = time.perf_counter()
+        self.sections = {}
+
+    def add_section(self, section: str, duration: float):
+        self.sections[section] = self.sections.get(section, 0) + duration
+
+    def timing_entries(self):
+        """Server-Timing entries for everything but the total"""
+        return [f'{section};dur={duration * 1000:.1f}' for section, duration in self.sections.items()]
+
+    def server_timing(self):
+        """Returns the value of the Server-Timing header for this request"""
+        total = time.perf_counter() - self.start
+        return ', '.join(self.timing_entries() + [f'total;dur={total * 1000:.1f}'])
+
+
+class CurrentRequest:
+    """The stats of the request being handled on each thread (each request is handled start to finish on one thread)"""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def get(self):
+        return getattr(self._local, 'stats', None)
+
+    def set(self, stats):
+        self._local.stats = stats
+
+    def pop(self):
+        stats = self.get()
+        self._local.stats = None
+        return stats
@@ -0,0 +1,153 @@
+# This file writes the stats cube to a binary snapshot file and maps it back in. Every server worker maps the same file
+# read-only, so the cube is loaded in milliseconds and its memory is shared between the workers (through the page cache)
+# instead of each one building its own copy from mongo.
+#
+# A snapshot file is the magic bytes, the length of a json header, the header (format version, dataset generation and
+# each block's tags and array layout) and then the raw arrays, each starting on an ALIGNMENT byte boundary. New
+# snapshots are written to a temporary file and renamed into place, then the CURRENT pointer file is swapped (also with
+# a rename) to point at it, so readers only ever see a complete snapshot.
+#
+# The ingest (MongoDB_Data_Input/parse_drawing_results.py) does not write snapshots, so running this after each ingest
+# is a required step when the server uses snapshots - until then it keeps serving the previous snapshot's data:
+#   python Snapshot.py --dir /var/lib/hunting-stats/snapshots
+import argparse
+import json
+import os
+import time
+import numpy as np
+import pymongo
+from StatsCube import CUBE_ARRAYS, CubeBlock, StatsCube
+
+MAGIC = b'HSCUBE\x00\x00'
+SNAPSHOT_VERSION = 1
+ALIGNMENT = 64
+POINTER_FILE = 'CURRENT'
+SNAPSHOT_PREFIX = 'stats_cube-'
+
+
+def _aligned(offset: int):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _replace(path: str, write):
+    """Writes a file through write(file) to a temporary file next to path, then renames it over path"""
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as temp_file:
+        write(temp_file)
+        temp_file.flush()
+        os.fsync(temp_file.fileno())
+    os.replace(temp_path, path)
+
+
+def write_snapshot(cube: StatsCube, directory: str, keep: int = 3):
+    """Writes the cube to a new snapshot file in directory, points CURRENT at it and removes all but the newest keep
+    snapshots. Returns the path of the new snapshot."""
+    os.makedirs(directory, exist_ok=True)
+
+    blocks = []
+    arrays = []
+    offset = 0
+    for (species, residency), block in cube.blocks.items():
+        layout = {}
+        for name in CUBE_ARRAYS:
+            array = np.ascontiguousarray(getattr(block, name))
+            layout[name] = {'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+            arrays.append((offset, array))
+            offset = _aligned(offset + array.nbytes)
+        blocks.append({'species': species, 'residency': residency, 'tags': block.tags, 'districts': block.districts,
+                       'regions': block.regions, 'first_year': block.first_year, 'num_years': block.num_years,
+                       'num_points': len(block.point_vals), 'arrays': layout})
+
+    generation = None if cube.generation is None else list(cube.generation)
+    header = json.dumps({'version': SNAPSHOT_VERSION, 'generation': generation, 'blocks': blocks}).encode()
+    data_start = _aligned(len(MAGIC) + 8 + len(header))
+
+    def write(snapshot_file):
+        snapshot_file.write(MAGIC)
+        snapshot_file.write(len(header).to_bytes(8, 'little'))
+        snapshot_file.write(header)
+        for array_offset, array in arrays:
+            snapshot_file.seek(data_start + array_offset)
+            snapshot_file.write(array.tobytes())
+        snapshot_file.truncate(data_start + offset)
+
+    name = f'{SNAPSHOT_PREFIX}{time.time_ns()}.snap'
+    path = os.path.join(directory, name)
+    _replace(path, write)
+    _replace(os.path.join(directory, POINTER_FILE),
+             lambda pointer_file: pointer_file.write(json.dumps({'file': name, 'generation': generation}).encode()))
+
+    # readers that still have an older snapshot mapped keep it until they let go of it (on windows the file stays)
+    snapshots = sorted(file for file in os.listdir(directory)
+                       if file.startswith(SNAPSHOT_PREFIX) and file.endswith('.snap'))
+    for old in snapshots[:-keep] if keep > 0 else []:
+        if old != name:
+            try:
+                os.remove(os.path.join(directory, old))
+            except OSError:
+                pass
+    return path
+
+
+def read_snapshot(path: str):
+    """Maps a snapshot file read-only and returns it as a StatsCube"""
+    with open(path, 'rb') as snapshot_file:
+        if snapshot_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is not a stats cube snapshot')
+        header_length = int.from_bytes(snapshot_file.read(8), 'little')
+        header = json.loads(snapshot_file.read(header_length))
+    if header['version'] != SNAPSHOT_VERSION:
+        raise ValueError(f"{path} is snapshot version {header['version']}, expected {SNAPSHOT_VERSION}")
+
+    data_start = _aligned(len(MAGIC) + 8 + header_length)
+    data = np.memmap(path, dtype=np.uint8, mode='r')
+    blocks = {}
+    for block in header['blocks']:
+        arrays = {}
+        for name, layout in block['arrays'].items():
+            dtype = np.dtype(layout['dtype'])
+            start = data_start + layout['offset']
+            count = int(np.prod(layout['shape']))
+            arrays[name] = data[start:start + count * dtype.itemsize].view(dtype).reshape(layout['shape'])
+        blocks[(block['species'], block['residency'])] = CubeBlock(
+            block['tags'], block['districts'], block['regions'], block['first_year'], block['num_years'],
+            block['num_points'], arrays)
+
+    generation = None if header['generation'] is None else tuple(header['generation'])
+    return StatsCube(blocks, generation)
+
+
+def current_snapshot(directory: str):
+    """Returns the contents of the CURRENT pointer file ({'file', 'generation'})"""
+    with open(os.path.join(directory, POINTER_FILE), 'rb') as pointer_file:
+        return json.loads(pointer_file.read())
+
+
+def snapshot_generation(directory: str):
+    """Returns the dataset generation of the current snapshot (what the cube read from it has as its generation)"""
+    generation = current_snapshot(directory)['generation']
+    return None if generation is None else tuple(generation)
+
+
+def load_current(directory: str):
+    """Maps the snapshot CURRENT points at"""
+    return read_snapshot(os.path.join(directory, current_snapshot(directory)['file']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a stats cube snapshot of the drawing results collection.')
+    parser.add_argument('--dir', default=os.getenv('CUBE_SNAPSHOT_DIR'), required=not os.getenv('CUBE_SNAPSHOT_DIR'),
+                        help='snapshot directory (default CUBE_SNAPSHOT_DIR)')
+    parser.add_argument('--keep', type=int, default=3, help='number of snapshots to keep')
+    args = parser.parse_args()
+
+    connection = pymongo.MongoClient(os.getenv('MONGODB_URI'))
+    started = time.perf_counter()
+    cube = StatsCube.from_collection(connection.hunting_research.drawing_results)
+    path = write_snapshot(cube, args.dir, args.keep)
+    connection.close()
+    print(f'wrote {path} ({os.path.getsize(path)} bytes) in {time.perf_counter() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+# This file defines an in-memory cube of the drawing results. The whole collection is small enough to hold as dense
+# arrays indexed by (tag, year, point) for every species/residency, which lets the query objects compute their stats
+# with array sums instead of sending an aggregation to mongo for every request.
+import numpy as np
+import pymongo
+from DatasetLoader import dataset_generation
+
+# point categories 0 - 20
+NUM_POINTS = 21
+
+# the stats arrays of a block
+CUBE_ARRAYS = ('applicants', 'successes', 'total_points', 'docs')
+
+# fields needed from each drawing result document
+CUBE_FIELDS = {'_id': 0, 'species': 1, 'residency': 1, 'tag_num': 1, 'district': 1, 'region': 1, 'dwg_year': 1,
+               'point_val': 1, 'applicants': 1, 'successes': 1, 'total_points': 1}
+
+
+class CubeBlock:
+    """The stats for a single species/residency. Each stat is an array with dimensions (tag, year, point). They start
+    out as zeros unless arrays (a dict of the CUBE_ARRAYS, e.g. mapped from a snapshot file) is given."""
+
+    def __init__(self, tags: list, districts: list, regions: list, first_year: int, num_years: int, num_points: int,
+                 arrays: dict = None):
+        self.tags = tags
+        self.districts = districts
+        self.regions = regions
+        self.first_year = first_year
+        self.num_years = num_years
+        self.tag_pos = {tag: i for i, tag in enumerate(tags)}
+
+        shape = (len(tags), num_years, num_points)
+        if arrays is None:
+            arrays = {'applicants': np.zeros(shape, dtype=np.int64), 'successes': np.zeros(shape, dtype=np.int64),
+                      'total_points': np.zeros(shape, dtype=np.int64), 'docs': np.zeros(shape, dtype=np.int32)}
+        self.applicants = arrays['applicants']
+        self.successes = arrays['successes']
+        self.total_points = arrays['total_points']
+        # number of documents that went into each cell, so "no documents" can be told apart from "0 applicants"
+        self.docs = arrays['docs']
+
+        self.point_vals = np.arange(num_points, dtype=np.int64)
+        self.district_tags = self._group_positions(districts)
+        self.region_tags = self._group_positions(regions)
+
+    @staticmethod
+    def _group_positions(keys: list):
+        groups = {}
+        for i, key in enumerate(keys):
+            groups.setdefault(key, []).append(i)
+        return {key: np.array(positions, dtype=np.int64) for key, positions in groups.items()}
+
+    def year_slice(self, start: int, end: int):
+        """Returns the first year and the slice of the year axis covered by start - end (clipped to the data)"""
+        first = max(start, self.first_year)
+        last = min(end, self.first_year + self.num_years - 1)
+        if first > last:
+            return first, slice(0, 0)
+        return first, slice(first - self.first_year, last - self.first_year + 1)
+
+
+class StatsCube:
+    """An immutable snapshot of the drawing results collection. The methods return their results in the same format as
+    the aggregations in the query objects so either one can be looped over the same way."""
+
+    def __init__(self, blocks: dict, generation=None):
+        self.blocks = blocks
+        self.generation = generation
+
+    @classmethod
+    def from_documents(cls, documents, generation=None):
+        """Builds the cube from an iterable of drawing result documents"""
+        grouped = {}
+        for doc in documents:
+            grouped.setdefault((doc['species'], doc['residency']), []).append(doc)
+
+        blocks = {}
+        for key, docs in grouped.items():
+            # a tag's district and region come from its first document
+            tag_info = {}
+            for doc in docs:
+                tag_info.setdefault(doc['tag_num'], (doc['district'], doc['region']))
+            tags = sorted(tag_info)
+
+            years = [doc['dwg_year'] for doc in docs]
+            first_year = min(years)
+            num_points = max(NUM_POINTS, max(doc['point_val'] for doc in docs) + 1)
+            block = CubeBlock(tags, [tag_info[tag][0] for tag in tags], [tag_info[tag][1] for tag in tags],
+                              first_year, max(years) - first_year + 1, num_points)
+
+            index = (np.array([block.tag_pos[doc['tag_num']] for doc in docs], dtype=np.int64),
+                     np.array(years, dtype=np.int64) - first_year,
+                     np.array([doc['point_val'] for doc in docs], dtype=np.int64))
+            np.add.at(block.applicants, index, np.array([doc['applicants'] for doc in docs], dtype=np.int64))
+            np.add.at(block.successes, index, np.array([doc['successes'] for doc in docs], dtype=np.int64))
+            np.add.at(block.total_points, index, np.array([doc['total_points'] for doc in docs], dtype=np.int64))
+            np.add.at(block.docs, index, 1)
+            blocks[key] = block
+
+        return cls(blocks, generation)
+
+    @classmethod
+    def from_collection(cls, doc_collection: pymongo.collection.Collection):
+        generation = dataset_generation(doc_collection)
+        return cls.from_documents(doc_collection.find({}, projection=CUBE_FIELDS), generation)
+
+    def _positions(self, block: CubeBlock, tag=None, district=None, region=None):
+        """Returns the positions of the tags matching the tag number, district or region given"""
+        if tag is not None:
+            if tag not in block.tag_pos:
+                return np.zeros(0, dtype=np.int64)
+            return np.array([block.tag_pos[tag]], dtype=np.int64)
+        if district is not None:
+            return block.district_tags.get(district, np.zeros(0, dtype=np.int64))
+        if region is not None:
+            return block.region_tags.get(region, np.zeros(0, dtype=np.int64))
+        return np.arange(len(block.tags), dtype=np.int64)
+
+    def year_stats(self, species: str, residency: str, start: int, end: int, tag=None, district=None, region=None):
+        """Sums the stats for each year between start and end for a tag, district or region. Matches the
+        '$group by year' aggregations."""
+        block = self.blocks.get((species, residency))
+        if block is None:
+            return []
+
+        first, years = block.year_slice(start, end)
+        positions = self._positions(block, tag, district, region)
+        applicants = block.applicants[positions, years]
+        sum_apps = applicants.sum(axis=(0, 2))
+        sum_tags = block.successes[positions, years].sum(axis=(0, 2))
+        sum_pts = block.total_points[positions, years].sum(axis=(0, 2))
+        sum_wa_pts = (applicants * block.point_vals).sum(axis=(0, 2))
+        has_docs = block.docs[positions, years].sum(axis=(0, 2)) > 0
+
+        return [{'_id': {'year': first + i}, 'sum_apps': int(sum_apps[i]), 'sum_tags': int(sum_tags[i]),
+                 'sum_pts': int(sum_pts[i]), 'sum_wa_pts': int(sum_wa_pts[i])}
+                for i in np.flatnonzero(has_docs)]
+
+    def point_stats(self, species: str, residency: str, tag: str, year: int):
+        """Returns the stats for each point category of a tag for a single year. Matches the '$group by points'
+        aggregation."""
+        block = self.blocks.get((species, residency))
+        if block is None or tag not in block.tag_pos:
+            return []
+
+        year_pos = year - block.first_year
+        if year_pos < 0 or year_pos >= block.num_years:
+            return []
+
+        tag_pos = block.tag_pos[tag]
+        applicants = block.applicants[tag_pos, year_pos]
+        successes = block.successes[tag_pos, year_pos]
+        total_points = block.total_points[tag_pos, year_pos]
+
+        return [{'_id': {'points': int(point)}, 'sum_apps': int(applicants[point]), 'sum_tags': int(successes[point]),
+                 'sum_pts': int(total_points[point])}
+                for point in np.flatnonzero(block.docs[tag_pos, year_pos])]
+
+    def tag_exists(self, species: str, residency: str, tag: str, start: int, end: int):
+        block = self.blocks.get((species, residency))
+        if block is None or tag not in block.tag_pos:
+            return False
+
+        _, years = block.year_slice(start, end)
+        return bool(block.docs[block.tag_pos[tag], years].any())
+
+    def _active_positions(self, block: CubeBlock, positions, start: int, end: int):
+        """Filters positions down to the tags that have documents between start and end"""
+        _, years = block.year_slice(start, end)
+        active = block.docs[positions, years].sum(axis=(1, 2)) > 0
+        return positions[active]
+
+    def district_tags(self, species: str, residency: str, district: str, start: int, end: int, after: str = None,
+                      limit: int = None):
+        """Returns the sorted tags within a district. Matches DistObject.get_tags."""
+        block = self.blocks.get((species, residency))
+        if block is None:
+            return []
+
+        positions = self._active_positions(block, self._positions(block, district=district), start, end)
+        tags = [block.tags[pos] for pos in positions]
+        if after is not None:
+            tags = [tag for tag in tags if tag > after]
+        if limit is not None:
+            tags = tags[:limit]
+        return [{'_id': {'tag num': tag}} for tag in tags]
+
+    def region_districts(self, species: str, residency: str, region: str, start: int, end: int):
+        """Returns the sorted districts within a region. Matches RegionsObject.get_districts."""
+        block = self.blocks.get((species, residency))
+        if block is None:
+            return []
+
+        positions = self._active_positions(block, self._positions(block, region=region), start, end)
+        districts = sorted({block.districts[pos] for pos in positions})
+        return [{'_id': {'district': district}} for district in districts]
+
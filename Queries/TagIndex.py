@@ -0,0 +1,90 @@
+# This file defines an in-memory index of every tag number by species/residency. It answers "does this tag exist" and
+# prefix (typeahead) searches without creating a TagObject or running an aggregation.
+from bisect import bisect_left
+import pymongo
+from DatasetLoader import dataset_generation
+
+
+class TagEntry:
+    """A tag number, where it is, and the (sorted) years it was drawn in."""
+
+    def __init__(self, tag: str, district: str, region: str, years: list):
+        self.tag = tag
+        self.district = district
+        self.region = region
+        self.years = sorted(years)
+
+    def drawn_between(self, start: int, end: int):
+        pos = bisect_left(self.years, start)
+        return pos < len(self.years) and self.years[pos] <= end
+
+    def convert_to_dict(self):
+        return {
+            'tag': self.tag,
+            'district': self.district,
+            'region': self.region,
+        }
+
+
+class TagIndex:
+    """Sorted tag numbers per (species, residency), so lookups are a dict get and prefix searches are a bisect."""
+
+    def __init__(self, entries: dict, generation=None):
+        # entries: {(species, residency): [TagEntry, ...]}
+        self.generation = generation
+        self._entries = {}
+        self._tags = {}
+        for key, tag_entries in entries.items():
+            tag_entries = sorted(tag_entries, key=lambda entry: entry.tag)
+            self._entries[key] = {entry.tag: entry for entry in tag_entries}
+            self._tags[key] = [entry.tag for entry in tag_entries]
+
+    @classmethod
+    def from_collection(cls, doc_collection: pymongo.collection.Collection):
+        generation = dataset_generation(doc_collection)
+        pipeline = [
+            {
+                '$group': {'_id': {'species': '$species', 'residency': '$residency', 'tag num': '$tag_num'},
+                           'district': {'$first': '$district'},
+                           'region': {'$first': '$region'},
+                           'years': {'$addToSet': '$dwg_year'}
+                           }
+            }
+        ]
+
+        entries = {}
+        for result in doc_collection.aggregate(pipeline, comment=cls.__name__):
+            key = (result['_id']['species'], result['_id']['residency'])
+            entry = TagEntry(result['_id']['tag num'], result['district'], result['region'], result['years'])
+            entries.setdefault(key, []).append(entry)
+        return cls(entries, generation)
+
+    @classmethod
+    def from_cube(cls, cube):
+        """Builds the index from a StatsCube instead of querying the collection again"""
+        entries = {}
+        for key, block in cube.blocks.items():
+            drawn = block.docs.sum(axis=2) > 0
+            entries[key] = [TagEntry(tag, block.districts[i], block.regions[i],
+                                     [block.first_year + int(year) for year in drawn[i].nonzero()[0]])
+                            for i, tag in enumerate(block.tags)]
+        return cls(entries, cube.generation)
+
+    def exists(self, species: str, residency: str, tag: str, start: int, end: int):
+        """Returns True if the tag was drawn for the species/residency in any year between start and end"""
+        entry = self._entries.get((species, residency), {}).get(tag)
+        return entry is not None and entry.drawn_between(start, end)
+
+    def search(self, species: str, residency: str, prefix: str, start: int, end: int, limit: int = 50):
+        """Returns up to limit tags (in tag number order) that start with prefix and were drawn between start and end"""
+        tags = self._tags.get((species, residency), [])
+        entries = self._entries.get((species, residency), {})
+
+        results = []
+        pos = bisect_left(tags, prefix)
+        while pos < len(tags) and tags[pos].startswith(prefix) and len(results) < limit:
+            entry = entries[tags[pos]]
+            if entry.drawn_between(start, end):
+                results.append(entry)
+            pos += 1
+        return results
@@ -1,23 +1,32 @@
 # This file defines the object for the tag level queries/stats
+import os
 import pymongo
 import PointStat
 import YearStat
+import Metrics
 import requests
 
+# the forecast service used when there is no in-process forecaster
+FORECAST_URL = os.getenv('FORECAST_URL', 'http://localhost:58585/calculate_odds')
+
 class TagObject:
 
     def __init__(self, tag_num: str, doc_collection: pymongo.collection.Collection, species: str, start_year: int,
-                 end_year: int, residency: str, simple_search=False):
+                 end_year: int, residency: str, simple_search=False, stats_cube=None, forecaster=None,
+                 check_exists=True):
         self.tag = tag_num
         self.doc_coll = doc_collection
         self.species = species.upper()
         self.start = start_year
         self.end = end_year
         self.residency = residency.upper()
+        self.stats_cube = stats_cube
+        self.forecaster = forecaster
         self.year_stats = [YearStat.YearStat(year) for year in range(self.start, self.end+1)]
         self.point_stats = [PointStat.PointStat(self.end, point) for point in range(21)]
         
-        self.exists = self.simple_search()
+        # callers that already know the tag exists (e.g. from a listing of the collection) can skip the query
+        self.exists = self.simple_search() if check_exists else True
 
         if not simple_search:
             self.query_year_stats()
@@ -36,8 +45,11 @@ class TagObject:
                             }
             },
         ]
-        
-        results = self.doc_coll.aggregate(pipeline)
+
+        if self.stats_cube is not None:
+            return self.stats_cube.tag_exists(self.species, self.residency, self.tag, self.start, self.end)
+
+        results = self.doc_coll.aggregate(pipeline, comment=self.__class__.__name__)
         for result in results:
             return True
         return False
@@ -73,7 +85,10 @@ class TagObject:
             }
         ]
 
-        stats = self.doc_coll.aggregate(pipeline)
+        if self.stats_cube is not None:
+            stats = self.stats_cube.year_stats(self.species, self.residency, self.start, self.end, tag=self.tag)
+        else:
+            stats = self.doc_coll.aggregate(pipeline, comment=self.__class__.__name__)
 
         # now loop through mongo query and create a year stat object for each stat, add it to the list of year stats
         for stat in stats:
@@ -107,7 +122,10 @@ class TagObject:
             }
         ]
 
-        pt_stats = self.doc_coll.aggregate(pipeline)
+        if self.stats_cube is not None:
+            pt_stats = self.stats_cube.point_stats(self.species, self.residency, self.tag, self.end)
+        else:
+            pt_stats = self.doc_coll.aggregate(pipeline, comment=self.__class__.__name__)
 
         # now loop through pt_stats and create a new object for each result, add to point_stat list
         for stat in pt_stats:
@@ -117,7 +135,16 @@ class TagObject:
             pts_stat_obj.set_perc_success()
 
     def predict_applicants(self):
-        """Calls a microservice with requests API to determine applicants for next year"""
+        """Determines applicants for next year with the in-process forecaster when there is one, otherwise calls a
+        microservice with requests API"""
+        if self.forecaster is not None:
+            with Metrics.timer('forecast', self.__class__.__name__):
+                next_years_apps = self.forecaster.predict(self.species, self.residency, self.tag, self.start, self.end)
+
+            for i, point_stat in enumerate(self.point_stats):
+                point_stat.set_next_years_apps(next_years_apps[i])
+            return
+
         last_years_apps = [stat.get_applicants() for stat in self.point_stats]
         last_years_successes = [stat.get_successes() for stat in self.point_stats]
         request_data = {
@@ -125,8 +152,9 @@ class TagObject:
             'prevYearSuccess': last_years_successes
         }
 
-        r = requests.get('http://localhost:58585/calculate_odds', json=request_data)
-        resp_body = r.json()
+        with Metrics.timer('forecast', self.__class__.__name__):
+            r = requests.get(FORECAST_URL, json=request_data)
+            resp_body = r.json()
         
         try:
             next_years_apps = resp_body['calculated']
@@ -0,0 +1,190 @@
+# This program backtests the drawing simulation against the actual drawing results. Every historical tag-year is replayed
+# through the simulator with that year's actual applicants per point category and its actual number of successes as the
+# number of tags, and the simulated tags per point category are compared with the actual successes.
+#
+# Calibration is measured per point category, pooled over every tag-year: the expected successes (from the simulation)
+# against the actual successes, as a bias % and a z-score. The variance of each tag-year's successes is taken as
+# binomial (applicants * p * (1 - p), p the simulated chance of drawing), so |z| much above 3 means the simulation is
+# off for that point category by more than chance. Use --max-z to fail (exit code 1) when any point category is
+# above it, e.g. to check a new simulation engine.
+#
+# The error of a tag is the % of its tags that the simulation hands to a different point category than the real drawing
+# did (half the summed absolute difference between simulated and actual successes, over the tags). Each real drawing is
+# a single random outcome, so this includes sampling noise - even a perfect simulation scores several % on tags with
+# many applicants and much more on tags with only a few tags. It is useful to find outliers and to compare engines
+# against each other on the same data, not as an absolute measure.
+#
+# example: python backtest.py --engine vector --iterations 1000 --max-z 4
+import argparse
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+import numpy as np
+import pymongo
+from DatasetLoader import DatasetLoader
+from StatsCube import StatsCube
+from TagObject import TagObject
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Drawing_Simulation'))
+import DrawSimul
+import SweepSimul
+
+
+def list_tag_years(doc_collection: pymongo.collection.Collection, start_year: int, end_year: int, species: str = None):
+    """Returns every (species, residency, tag, year) drawn between start_year and end_year"""
+    match = {'dwg_year': {'$gte': start_year, '$lte': end_year}}
+    if species is not None:
+        match['species'] = species.upper()
+
+    pipeline = [
+        {
+            '$match': match
+        },
+        {
+            '$group': {'_id': {'species': '$species', 'residency': '$residency', 'tag num': '$tag_num',
+                               'year': '$dwg_year'}}
+        },
+        {
+            '$sort': {'_id': pymongo.ASCENDING}
+        }
+    ]
+    results = doc_collection.aggregate(pipeline, comment='backtest')
+    return [(result['_id']['species'], result['_id']['residency'], result['_id']['tag num'], result['_id']['year'])
+            for result in results]
+
+
+def actual_results(doc_collection: pymongo.collection.Collection, species: str, residency: str, tag: str, year: int,
+                   stats_cube: StatsCube = None):
+    """Returns the actual (applicants, successes) per point category of a tag-year"""
+    tag_obj = TagObject(tag, doc_collection, species, year, year, residency, simple_search=True, stats_cube=stats_cube,
+                        check_exists=False)
+    tag_obj.query_point_stats()
+    return ([stat.get_applicants() for stat in tag_obj.point_stats],
+            [stat.get_successes() for stat in tag_obj.point_stats])
+
+
+def replay_tag_year(job: dict):
+    """Worker process entry point - simulates one tag-year and adds the simulated successes per point category"""
+    num_tags = sum(job['successes'])
+    if job['engine'] == 'bag':
+        total_results, _ = DrawSimul.simulate_odds(job['applicants'], job['tag_num'], num_tags, job['iterations'])
+        total_results = np.array(total_results)
+    else:
+        _, wins, _ = SweepSimul.sweep_odds(job['applicants'], [num_tags], [1.0], job['iterations'])
+        total_results = wins[0, 0]
+
+    job['simulated'] = (total_results / job['iterations']).round(4).tolist()
+    return job
+
+
+def calibration_error(simulated: np.ndarray, actual: np.ndarray):
+    """% of the tags handed to a different point category than in the actual drawing"""
+    num_tags = actual.sum()
+    return 0.0 if num_tags == 0 else float(np.abs(simulated - actual).sum() / (2 * num_tags) * 100)
+
+
+def point_calibration(replays: list):
+    """Pools every tag-year by point category. Returns (applicants, expected successes, actual successes, bias %,
+    z-score) arrays with one entry per point category."""
+    applicants = np.array([replay['applicants'] for replay in replays], dtype=np.float64)
+    expected = np.array([replay['simulated'] for replay in replays], dtype=np.float64)
+    actual = np.array([replay['successes'] for replay in replays], dtype=np.float64)
+
+    chance = np.divide(expected, applicants, out=np.zeros(expected.shape), where=applicants > 0)
+    variance = (applicants * chance * (1 - chance)).sum(axis=0)
+    difference = actual.sum(axis=0) - expected.sum(axis=0)
+    bias = np.divide(difference, expected.sum(axis=0), out=np.zeros(difference.shape), where=expected.sum(axis=0) > 0)
+    z_score = np.divide(difference, np.sqrt(variance), out=np.zeros(difference.shape), where=variance > 0)
+    return applicants.sum(axis=0), expected.sum(axis=0), actual.sum(axis=0), bias * 100, z_score
+
+
+def summarize(replays: list):
+    """Returns the calibration error per (species, residency, tag) over all its years, and the total error"""
+    by_tag = {}
+    for replay in replays:
+        key = (replay['species'], replay['residency'], replay['tag_num'])
+        simulated, actual = by_tag.setdefault(key, ([], []))
+        simulated.append(replay['simulated'])
+        actual.append(replay['successes'])
+
+    tag_errors = {key: calibration_error(np.array(simulated), np.array(actual))
+                  for key, (simulated, actual) in by_tag.items()}
+    total_error = calibration_error(np.array([replay['simulated'] for replay in replays]),
+                                    np.array([replay['successes'] for replay in replays])) if replays else 0.0
+    return tag_errors, total_error
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backtest the drawing simulation against the actual drawing results.')
+    parser.add_argument('--start-year', type=int, default=2017)
+    parser.add_argument('--end-year', type=int, default=2021)
+    parser.add_argument('--species', help='only backtest this species')
+    parser.add_argument('--engine', choices=['bag', 'vector'], default='bag',
+                        help='DrawSimul bag drawing or the vectorized SweepSimul drawing')
+    parser.add_argument('--iterations', type=int, default=200, help='simulated drawings per tag-year')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='simulation worker processes')
+    parser.add_argument('--backend', choices=['mongo', 'cube'], default='mongo',
+                        help='read the actual results with aggregations or from a stats cube')
+    parser.add_argument('--worst', type=int, default=20, help='number of tags with the highest error to print')
+    parser.add_argument('--max-z', type=float,
+                        help='exit with code 1 if the pooled z-score of any point category is further from 0')
+    parser.add_argument('--max-error', type=float,
+                        help='exit with code 1 if the total error (%%) is higher. The error includes the sampling noise '
+                             'of the real drawings, so set this from a baseline run of the current engine')
+    parser.add_argument('--output', help='write the per tag-year results to this json file')
+    args = parser.parse_args()
+
+    connection = pymongo.MongoClient(os.getenv('MONGODB_URI'))
+    collection = connection.hunting_research.drawing_results
+    stats_cube = DatasetLoader(collection, StatsCube.from_collection).get() if args.backend == 'cube' else None
+
+    started = time.perf_counter()
+    tag_years = list_tag_years(collection, args.start_year, args.end_year, args.species)
+    print(f'{len(tag_years)} tag-years to replay with the {args.engine} engine')
+
+    def jobs():
+        # the actual results are read here while the pool replays earlier tag-years
+        for species, residency, tag, year in tag_years:
+            applicants, successes = actual_results(collection, species, residency, tag, year, stats_cube)
+            yield {'species': species, 'residency': residency, 'tag_num': tag, 'dwg_year': year,
+                   'applicants': applicants, 'successes': successes, 'engine': args.engine,
+                   'iterations': args.iterations}
+
+    with Pool(args.workers) as pool:
+        replays = list(pool.imap_unordered(replay_tag_year, jobs()))
+    connection.close()
+    runtime = time.perf_counter() - started
+
+    applicants, expected, actual, bias, z_score = point_calibration(replays) if replays else ([],) * 5
+    print(f"{'points':>6} {'applicants':>11} {'expected':>10} {'actual':>8} {'bias %':>8} {'z':>7}")
+    for points in np.flatnonzero(applicants):
+        print(f'{points:>6} {applicants[points]:>11.0f} {expected[points]:>10.1f} {actual[points]:>8.0f} '
+              f'{bias[points]:>8.1f} {z_score[points]:>7.2f}')
+
+    tag_errors, total_error = summarize(replays)
+    print(f"\n{'species':<8} {'res':<12} {'tag':<12} {'error %':>8}")
+    for (species, residency, tag), error in sorted(tag_errors.items(), key=lambda item: -item[1])[:args.worst]:
+        print(f'{species:<8} {residency:<12} {tag:<12} {error:>8.1f}')
+    print(f'total error {total_error:.2f}% (including sampling noise) over {len(replays)} tag-years in {runtime:.1f}s')
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({'engine': args.engine, 'iterations': args.iterations, 'runtime': runtime,
+                       'total error': total_error, 'point bias %': list(np.round(bias, 2)),
+                       'point z-score': list(np.round(z_score, 2)), 'replays': replays}, output_file, indent=2)
+
+    failed = False
+    if args.max_z is not None and len(z_score) and np.abs(z_score).max() > args.max_z:
+        print(f'a point category is miscalibrated beyond --max-z {args.max_z}')
+        failed = True
+    if args.max_error is not None and total_error > args.max_error:
+        print(f'total error is above --max-error {args.max_error}%')
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+# This program load tests the Queries server. It seeds a mongo stand-in with synthetic drawing results, stubs the
+# forecast service, then drives every route of server.py at the requested concurrency and reports latency percentiles
+# and throughput per route.
+#
+# By default the data lives in mongomock (pip install mongomock), so no mongo server is needed. Pass --mongo-uri to
+# seed a real (local) mongo instead. mongomock runs aggregations in pure python (seconds per request) and publishes no
+# command monitoring events, so mongo backend numbers (and the mongo Server-Timing / aggregation metrics) only mean
+# something with --mongo-uri. Under mongomock, compare the cube backend or the rest of the request path.
+#
+# example: python load_test.py --tags-per-district 8 --concurrency 16 --requests 200 --output run1.json
+import argparse
+import json
+import logging
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SPECIES = ['ELK', 'MOOSE', 'SHEEP']
+RESIDENCIES = ['RESIDENT', 'NONRESIDENT']
+REGIONS = [str(region) for region in range(1, 8)]
+LOAD_TEST_DB = 'hunting_research_load_test'
+
+
+def synthetic_documents(districts_per_region: int, tags_per_district: int, first_year: int, end_year: int,
+                        seed: int = 0):
+    """Generates drawing result documents shaped like the ones parse_drawing_results.py uploads"""
+    rng = random.Random(seed)
+    for species in SPECIES:
+        for residency in RESIDENCIES:
+            for region in REGIONS:
+                for dist_num in range(districts_per_region):
+                    district = f'{region}{dist_num:02d}'
+                    for tag_num in range(tags_per_district):
+                        tag = f'{district}-{tag_num:02d}'
+                        popularity = rng.randint(5, 400)
+                        for year in range(first_year, end_year + 1):
+                            for point_val in range(21):
+                                # applicants thin out as the point categories go up
+                                applicants = int(popularity * rng.random() / (1 + point_val))
+                                if applicants == 0 and point_val > 0:
+                                    continue
+                                successes = rng.randint(0, max(1, applicants // 4)) if applicants else 0
+                                adjusted_basis = 1 if point_val == 0 else point_val ** 2
+                                yield {
+                                    'dwg_year': year,
+                                    'species': species,
+                                    'license_num': 1000 + tag_num,
+                                    'license_type': f'{species} Permit',
+                                    'district': district,
+                                    'tag_num': tag,
+                                    'region': region,
+                                    'residency': residency,
+                                    'point_val': point_val,
+                                    'applicants': applicants,
+                                    'successes': successes,
+                                    'total_points': applicants * adjusted_basis
+                                }
+
+
+def seed_collection(args):
+    """Creates the stand-in collection and fills it with synthetic drawing results"""
+    if args.mongo_uri:
+        import pymongo
+        collection = pymongo.MongoClient(args.mongo_uri)[LOAD_TEST_DB].drawing_results
+    else:
+        try:
+            import mongomock
+        except ImportError:
+            raise SystemExit('mongomock is required for the in-memory stand-in (pip install mongomock), '
+                             'or pass --mongo-uri to use a local mongo')
+        collection = mongomock.MongoClient()[LOAD_TEST_DB].drawing_results
+
+    collection.drop()
+    docs = list(synthetic_documents(args.districts_per_region, args.tags_per_district, args.first_year, args.end_year,
+                                    args.seed))
+    collection.insert_many(docs)
+    return collection, len(docs)
+
+
+class ForecastStub(BaseHTTPRequestHandler):
+    """Stands in for the forecast service. Next year's applicants are last year's applicants."""
+
+    def do_GET(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        payload = json.dumps({'calculated': body.get('prevYearApplication', [0] * 21)}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_in_thread(http_server):
+    thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+    thread.start()
+    return http_server
+
+
+def start_queries_server(collection, backend: str, forecast: str, forecast_port: int):
+    """Imports the Queries app, points it at the stand-in collection and forecast stub and serves it on a free local
+    port"""
+    os.environ['QUERIES_BACKEND'] = backend
+    os.environ['FORECAST_BACKEND'] = forecast
+    os.environ['FORECAST_URL'] = f'http://127.0.0.1:{forecast_port}/calculate_odds'
+    import server
+    from werkzeug.serving import make_server
+
+    # the per-request access log would drown out the report
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    server.set_collections(collection, collection.database.draw_odds)
+    server.warm_up()
+
+    return start_in_thread(make_server('127.0.0.1', 0, server.app, threaded=True))
+
+
+def build_routes(collection, end_year: int, seed: int):
+    """Returns a {route name: [urls]} dict that covers every route in server.py using tags from the seeded data"""
+    rng = random.Random(seed)
+    docs = list(collection.find({'dwg_year': end_year}, projection={'_id': 0, 'species': 1, 'residency': 1,
+                                                                     'region': 1, 'district': 1, 'tag_num': 1}))
+    combos = sorted({(doc['species'], doc['residency'], doc['region'], doc['district'], doc['tag_num'])
+                     for doc in docs})
+
+    routes = {name: [] for name in ['regions_stats', 'districts', 'district tags', 'district tags (stream)', 'tag',
+                                    'tag search', 'tag stats', 'tag odds', 'rankings', 'metrics']}
+    for species, residency, region, district, tag in combos:
+        prefix = f'/residency/{residency.lower()}/species/{species.lower()}'
+        routes['regions_stats'].append(f'{prefix}/regions_stats')
+        routes['districts'].append(f'{prefix}/region/{region}/districts')
+        routes['district tags'].append(f'{prefix}/region/{region}/district/{district}/tags')
+        routes['district tags (stream)'].append(f'{prefix}/region/{region}/district/{district}/tags?stream=true')
+        routes['tag'].append(f'{prefix}/tags/{tag}')
+        routes['tag search'].append(f'{prefix}/tag_search?q={district}-')
+        routes['tag stats'].append(f'{prefix}/tags/{tag}/stats')
+        routes['tag odds'].append(f'{prefix}/tags/{tag}/odds')
+        routes['rankings'].append(f'{prefix}/points/{rng.randint(0, 20)}/rankings?n=10')
+        routes['rankings'].append(f'{prefix}/points/{rng.randint(0, 20)}/rankings?basis=predicted&region={region}')
+    routes['metrics'].append('/metrics')
+
+    return {name: sorted(set(urls)) for name, urls in routes.items()}
+
+
+def timed_get(url: str):
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=120) as resp:
+            resp.read()
+            ok = resp.status == 200
+    except (urllib.error.URLError, OSError):
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+def percentile(sorted_values: list, perc: float):
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, int(round(perc / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_load(base_url: str, routes: dict, requests_per_route: int, concurrency: int, seed: int):
+    """Sends requests_per_route requests to every route (picking urls at random) in a shuffled order from
+    concurrency threads. Returns the report dict."""
+    rng = random.Random(seed)
+    jobs = [(name, base_url + rng.choice(urls)) for name, urls in routes.items() for _ in range(requests_per_route)]
+    rng.shuffle(jobs)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda job: (job[0],) + timed_get(job[1]), jobs))
+    wall_time = time.perf_counter() - start
+
+    report = {'concurrency': concurrency, 'wall time s': round(wall_time, 3),
+              'throughput rps': round(len(jobs) / wall_time, 2), 'routes': {}}
+    for name in routes:
+        latencies = sorted(latency for route, latency, ok in results if route == name)
+        report['routes'][name] = {
+            'requests': len(latencies),
+            'errors': sum(1 for route, _, ok in results if route == name and not ok),
+            'p50 ms': round(percentile(latencies, 50) * 1000, 2),
+            'p95 ms': round(percentile(latencies, 95) * 1000, 2),
+            'p99 ms': round(percentile(latencies, 99) * 1000, 2),
+            'throughput rps': round(len(latencies) / wall_time, 2)
+        }
+    return report
+
+
+def print_report(report: dict, baseline: dict = None):
+    print(f"\n{'route':<26}{'reqs':>6}{'errs':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'rps':>9}")
+    for name, stats in report['routes'].items():
+        line = (f"{name:<26}{stats['requests']:>6}{stats['errors']:>6}{stats['p50 ms']:>10}{stats['p95 ms']:>10}"
+                f"{stats['p99 ms']:>10}{stats['throughput rps']:>9}")
+        if baseline is not None and name in baseline['routes'] and baseline['routes'][name]['p95 ms']:
+            change = stats['p95 ms'] / baseline['routes'][name]['p95 ms'] - 1
+            line += f"   p95 {change:+.0%} vs baseline"
+        print(line)
+    print(f"\ntotal: {report['throughput rps']} requests/s over {report['wall time s']} s "
+          f"at concurrency {report['concurrency']}")
+    if report.get('store') == 'mongomock' and report.get('backend') == 'mongo':
+        print('note: mongomock runs the aggregations in python and reports no mongo timings, so these mongo backend '
+              'numbers are only comparable with runs against the same stand-in - use --mongo-uri for real ones')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the Queries server against synthetic drawing results.')
+    parser.add_argument('--mongo-uri', help=f'seed a real mongo (database {LOAD_TEST_DB}) instead of mongomock')
+    parser.add_argument('--backend', choices=['mongo', 'cube'], default='mongo', help='query backend to test')
+    parser.add_argument('--forecast', choices=['local', 'service'], default='local',
+                        help='forecast in process or call the (stubbed) forecast service')
+    parser.add_argument('--districts-per-region', type=int, default=1)
+    parser.add_argument('--tags-per-district', type=int, default=1)
+    parser.add_argument('--first-year', type=int, default=2020)
+    parser.add_argument('--end-year', type=int, default=2021, help='must match END_YEAR in server.py')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=5, help='requests sent to each route')
+    parser.add_argument('--forecast-port', type=int, default=0,
+                        help='port the forecast stub listens on (default: any free port)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the report to this json file')
+    parser.add_argument('--compare', help='json report from an earlier run to compare p95 latencies against')
+    args = parser.parse_args()
+
+    collection, num_docs = seed_collection(args)
+    print(f'Seeded {num_docs} drawing result documents')
+
+    forecast_stub = start_in_thread(ThreadingHTTPServer(('127.0.0.1', args.forecast_port), ForecastStub))
+    queries_server = start_queries_server(collection, args.backend, args.forecast, forecast_stub.server_port)
+    base_url = f'http://127.0.0.1:{queries_server.server_port}'
+
+    routes = build_routes(collection, args.end_year, args.seed)
+    report = run_load(base_url, routes, args.requests, args.concurrency, args.seed)
+    report['backend'] = args.backend
+    report['forecast'] = args.forecast
+    report['documents'] = num_docs
+    report['store'] = 'mongo' if args.mongo_uri else 'mongomock'
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+    print_report(report, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+
+    queries_server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
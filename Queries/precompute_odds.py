@@ -0,0 +1,174 @@
+# This program precomputes next year's draw odds for every (species, residency, tag) in the drawing results so the
+# Queries server can serve them without calling the forecast and drawing simulation services for every user. It should
+# be run after each ingest.
+#
+# For each tag it forecasts next year's applicants (through TagObject, in process by default), then runs the drawing
+# simulation many times in a pool of worker processes and stores the per point category odds in the draw_odds
+# collection. Each tag is saved as soon as it finishes, tagged with the dataset generation, so an interrupted run picks
+# up where it left off.
+#
+# The simulation is the vectorized SweepSimul drawing by default, or the DrawSimul bag with --engine bag (the same
+# drawing, much slower). --engine statewide instead runs one StatewideSimul drawing over every tag of a
+# species/residency, its iterations split over the worker processes, and saves the tags when their species/residency
+# finishes. The drawing results have no second choices, so the tags don't compete and the odds match the per tag
+# drawing.
+#
+# example: python precompute_odds.py --engine vector --iterations 2000 --workers 8
+import argparse
+import datetime
+import os
+import sys
+from itertools import groupby
+from multiprocessing import Pool
+import numpy as np
+import pymongo
+from DatasetLoader import DatasetLoader, dataset_generation
+from Forecast import ForecastEngine
+from StatsCube import StatsCube
+from TagObject import TagObject
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Drawing_Simulation'))
+import DrawSimul
+import StatewideSimul
+import SweepSimul
+
+# first year of stats used for a tag (matches the server)
+START_YEAR = 2017
+
+
+def list_tags(doc_collection: pymongo.collection.Collection, end_year: int, species: str = None):
+    """Returns every (species, residency, tag) that was drawn in end_year"""
+    match = {'dwg_year': end_year}
+    if species is not None:
+        match['species'] = species.upper()
+
+    pipeline = [
+        {
+            '$match': match
+        },
+        {
+            '$group': {'_id': {'species': '$species', 'residency': '$residency', 'tag num': '$tag_num'}}
+        },
+        {
+            '$sort': {'_id': pymongo.ASCENDING}
+        }
+    ]
+    results = doc_collection.aggregate(pipeline, comment='precompute_odds')
+    return [(result['_id']['species'], result['_id']['residency'], result['_id']['tag num']) for result in results]
+
+
+def forecast_tag(doc_collection: pymongo.collection.Collection, species: str, residency: str, tag: str, end_year: int,
+                 forecaster: ForecastEngine = None):
+    """Returns next year's forecast applicants for each point category and the number of tags (this year's quota,
+    estimated as the number of successful applicants). With a forecaster everything comes from its stats cube,
+    otherwise from mongo and the forecast service."""
+    stats_cube = None if forecaster is None else forecaster.cube_loader.get()
+    tag_obj = TagObject(tag, doc_collection, species, START_YEAR, end_year, residency, simple_search=True,
+                        stats_cube=stats_cube, forecaster=forecaster, check_exists=False)
+    tag_obj.query_point_stats()
+    tag_obj.predict_applicants()
+
+    point_stats = [stat.convert_to_dict() for stat in tag_obj.point_stats]
+    return [stat['future apps'] for stat in point_stats], sum(stat['successes'] for stat in point_stats)
+
+
+def simulate_tag(job: dict):
+    """Worker process entry point - runs the simulations for one tag and returns the odds document"""
+    if job['engine'] == 'bag':
+        total_results, perc_chance = DrawSimul.simulate_odds(job['calculated'], job['tag_num'], job['num tags'],
+                                                             job['iterations'])
+    else:
+        _, wins, perc = SweepSimul.sweep_odds(job['calculated'], [job['num tags']], [1.0], job['iterations'])
+        total_results, perc_chance = wins[0, 0].tolist(), perc[0, 0].tolist()
+    job['total tags obtained'] = total_results
+    job['calculated success perc'] = perc_chance
+    job['computed at'] = datetime.datetime.now(datetime.timezone.utc)
+    return job
+
+
+def simulate_statewide(jobs: list, workers: int):
+    """Runs one statewide drawing for the jobs (every tag of a species/residency, same iterations) with the iterations
+    split over workers processes, and returns the odds documents"""
+    num_points = max(len(job['calculated']) for job in jobs)
+    tag_apps = np.zeros((len(jobs), num_points), dtype=np.int64)
+    for i, job in enumerate(jobs):
+        tag_apps[i, :len(job['calculated'])] = job['calculated']
+
+    pool = StatewideSimul.ApplicantPool.from_tag_counts(tag_apps)
+    drawing = StatewideSimul.StatewideDrawing(pool, [job['num tags'] for job in jobs])
+    results = drawing.run(jobs[0]['iterations'], workers)
+    perc = results.first_choice_perc()
+    computed_at = datetime.datetime.now(datetime.timezone.utc)
+    for i, job in enumerate(jobs):
+        num_points = len(job['calculated'])
+        job['total tags obtained'] = results.first_wins[i, :num_points].tolist()
+        job['calculated success perc'] = perc[i, :num_points].tolist()
+        job['computed at'] = computed_at
+    return jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Precompute draw odds for every tag into the draw_odds collection.')
+    parser.add_argument('--end-year', type=int, default=2021, help='last year of drawing results (END_YEAR)')
+    parser.add_argument('--species', help='only precompute this species')
+    parser.add_argument('--engine', choices=['bag', 'vector', 'statewide'], default='vector',
+                        help='vectorized SweepSimul drawing, the DrawSimul bag drawing or one StatewideSimul '
+                             'drawing per species/residency')
+    parser.add_argument('--iterations', type=int, default=1000, help='simulated drawings per tag')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='simulation worker processes')
+    parser.add_argument('--restart', action='store_true', help='recompute every tag, ignoring finished ones')
+    parser.add_argument('--forecast', choices=['local', 'service'], default='local',
+                        help='forecast in process or call the forecast service on port 58585')
+    args = parser.parse_args()
+
+    connection = pymongo.MongoClient(os.getenv('MONGODB_URI'))
+    collection = connection.hunting_research.drawing_results
+    odds_collection = connection.hunting_research.draw_odds
+    odds_collection.create_index([('species', pymongo.ASCENDING), ('residency', pymongo.ASCENDING),
+                                  ('tag_num', pymongo.ASCENDING)], unique=True)
+    # the server finds the newest odds to tell when the rankings need rebuilding
+    odds_collection.create_index([('computed at', pymongo.DESCENDING)])
+
+    # odds computed from the same data with at least as many iterations don't need to be computed again
+    generation = list(dataset_generation(collection))
+    finished = set()
+    if not args.restart:
+        done = odds_collection.find({'generation': generation, 'iterations': {'$gte': args.iterations}},
+                                    projection={'_id': 0, 'species': 1, 'residency': 1, 'tag_num': 1})
+        finished = {(doc['species'], doc['residency'], doc['tag_num']) for doc in done}
+
+    tags = [tag for tag in list_tags(collection, args.end_year, args.species) if tag not in finished]
+
+    forecaster = None
+    if args.forecast == 'local':
+        forecaster = ForecastEngine(DatasetLoader(collection, StatsCube.from_collection))
+
+    print(f'{len(finished)} tags already done, {len(tags)} to go')
+
+    def jobs():
+        # forecasts are made here (they may call the forecast service) while the pool works on earlier tags
+        for species, residency, tag in tags:
+            next_years_apps, num_tags = forecast_tag(collection, species, residency, tag, args.end_year, forecaster)
+            yield {'species': species, 'residency': residency, 'tag_num': tag, 'dwg_year': args.end_year + 1,
+                   'calculated': next_years_apps, 'num tags': num_tags, 'engine': args.engine,
+                   'iterations': args.iterations, 'generation': generation}
+
+    def save(all_odds):
+        for count, odds in enumerate(all_odds, start=1):
+            odds_collection.replace_one({'species': odds['species'], 'residency': odds['residency'],
+                                         'tag_num': odds['tag_num']}, odds, upsert=True)
+            print(f"[{count}/{len(tags)}] {odds['species']} {odds['residency']} {odds['tag_num']}")
+
+    if args.engine == 'statewide':
+        # the tags are listed in species/residency order, so each group is one statewide drawing
+        groups = groupby(jobs(), key=lambda job: (job['species'], job['residency']))
+        save(odds for _, group in groups for odds in simulate_statewide(list(group), args.workers))
+    else:
+        with Pool(args.workers) as pool:
+            save(pool.imap_unordered(simulate_tag, jobs()))
+
+    connection.close()
+
+
+if __name__ == '__main__':
+    main()
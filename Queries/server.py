@@ -2,20 +2,128 @@
 from RegObject import RegionsObject
 from DistObject import DistObject
 from TagObject import TagObject
-from flask import Flask, jsonify
+from StatsCube import StatsCube
+import Snapshot
+from TagIndex import TagIndex
+from DatasetLoader import DatasetLoader, dataset_generation
+from Forecast import ForecastEngine
+from RankingIndex import BASES, RankingIndex
+from flask import Flask, Response, jsonify, request, stream_with_context
+import json
+import os
 import pymongo
+import Metrics
+import Profiling
 
 # initialize the app
 app = Flask(__name__)
-
-# connect to the collection that we would like to query
-connection = pymongo.MongoClient()
-db = connection.hunting_research
-collection = db.drawing_results
+Profiling.install(app)
 
 # define constants used throughout 
 END_YEAR = 2021
 
+# set QUERIES_BACKEND=cube to serve the stats from an in-memory cube of the collection instead of running aggregations
+USE_STATS_CUBE = os.getenv('QUERIES_BACKEND', 'mongo').lower() == 'cube'
+
+# next year's applicants are forecast in process unless FORECAST_BACKEND=service (the forecast service on port 58585)
+USE_LOCAL_FORECAST = os.getenv('FORECAST_BACKEND', 'local').lower() != 'service'
+
+# how often (seconds) the in-memory data checks the collection for newly ingested results
+REFRESH_SECONDS = float(os.getenv('REFRESH_SECONDS', '60'))
+
+# with CUBE_SNAPSHOT_DIR set, the cube is mapped from the snapshots Snapshot.py writes there instead of being built from
+# the collection (shared by all the workers, and swapped when a new snapshot is written)
+SNAPSHOT_DIR = os.getenv('CUBE_SNAPSHOT_DIR')
+
+# routes left out of the request metrics (scrapes and health checks)
+UNTIMED_ENDPOINTS = ('get_metrics', 'get_health', 'get_readiness')
+
+# how long (seconds) the readiness check waits for mongo
+READY_PING_TIMEOUT = 2
+
+
+def set_collections(drawing_results: pymongo.collection.Collection, draw_odds: pymongo.collection.Collection):
+    """Points the server, and all of the in-memory data it derives from the collections, at the given collections"""
+    global collection, odds_collection, stats_cube, dataset_cube, tag_index, forecaster, rankings
+    collection = drawing_results
+    odds_collection = draw_odds
+
+    # stats_cube answers the queries when it is turned on. Data derived from the whole dataset (forecasts, rankings)
+    # is always built from a cube, the same one when there is one.
+    stats_cube = None
+    if USE_STATS_CUBE:
+        stats_cube = DatasetLoader(collection, build_cube, REFRESH_SECONDS, cube_generation)
+    dataset_cube = stats_cube or DatasetLoader(collection, build_cube, REFRESH_SECONDS, cube_generation)
+
+    # tag_index holds every tag number, used for tag lookups and typeahead search. With the cube turned on (or mapped
+    # from a snapshot) it is built from the cube rather than with another pass over the collection.
+    if USE_STATS_CUBE or SNAPSHOT_DIR:
+        tag_index = DatasetLoader(collection, lambda doc_collection: TagIndex.from_cube(dataset_cube.get()),
+                                  REFRESH_SECONDS, cube_generation)
+    else:
+        tag_index = DatasetLoader(collection, TagIndex.from_collection, REFRESH_SECONDS)
+
+    forecaster = None
+    if USE_LOCAL_FORECAST:
+        forecaster = ForecastEngine(dataset_cube)
+
+    # the rankings also have to be rebuilt when precompute_odds.py writes new odds
+    rankings = DatasetLoader(collection, build_rankings, REFRESH_SECONDS, rankings_generation)
+
+
+def build_cube(doc_collection: pymongo.collection.Collection):
+    if SNAPSHOT_DIR:
+        return Snapshot.load_current(SNAPSHOT_DIR)
+    return StatsCube.from_collection(doc_collection)
+
+
+def cube_generation(doc_collection: pymongo.collection.Collection):
+    if SNAPSHOT_DIR:
+        return Snapshot.snapshot_generation(SNAPSHOT_DIR)
+    return dataset_generation(doc_collection)
+
+
+def odds_generation():
+    """Changes whenever precompute_odds.py writes odds. A re-run replaces the documents in place (same count and object
+    ids), so this uses the time the newest odds were computed rather than dataset_generation."""
+    newest = odds_collection.find_one({}, projection={'_id': 0, 'computed at': 1},
+                                      sort=[('computed at', pymongo.DESCENDING)])
+    computed_at = None if newest is None or 'computed at' not in newest else newest['computed at'].isoformat()
+    return odds_collection.estimated_document_count(), computed_at
+
+
+def rankings_generation(doc_collection: pymongo.collection.Collection):
+    return cube_generation(doc_collection), odds_generation()
+
+
+def build_rankings(doc_collection: pymongo.collection.Collection):
+    cube = dataset_cube.get()
+    # read before the odds, so odds written while building are picked up at the next refresh
+    generation = (cube.generation, odds_generation())
+    odds_docs = odds_collection.find({}, projection={'_id': 0, 'species': 1, 'residency': 1, 'tag_num': 1,
+                                                     'calculated': 1, 'calculated success perc': 1})
+    return RankingIndex.build(cube, odds_docs, 2017, END_YEAR, generation)
+
+
+# connect to the collection that we would like to query (localhost:27017 unless MONGODB_URI is set)
+connection = pymongo.MongoClient(os.getenv('MONGODB_URI'), event_listeners=[Metrics.QueryListener()])
+db = connection.hunting_research
+set_collections(db.drawing_results, db.draw_odds)
+
+
+def warm_up():
+    """Connects to mongo and builds the in-memory data before the server starts taking requests"""
+    collection.database.command('ping')
+    dataset_cube.load()
+    tag_index.load()
+    rankings.load()
+
+
+def is_warm():
+    """True once the in-memory data has been built, by warm_up or by the first requests that needed it"""
+    return dataset_cube.loaded and tag_index.loaded and rankings.loaded
+
+
 def reformat_residency(res_choice: str):
     """Reformats the residency choice to match what is required for the queries"""
     if res_choice[:2].upper() == "NON":
@@ -24,14 +132,45 @@ def reformat_residency(res_choice: str):
         return "resident"
 
 
+def current_cube():
+    """Returns the stats cube for this request, or None when the queries should go to mongo"""
+    if stats_cube is None:
+        return None
+    return stats_cube.get()
+
+
+def wants_stream():
+    """Streaming is opt in, either with ?stream=true or by asking for newline delimited json"""
+    if request.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return 'application/x-ndjson' in request.headers.get('Accept', '')
+
+
+# start collecting query stats for every request except metrics scrapes and health checks
+@app.before_request
+def before_request():
+    if request.url_rule is not None and request.endpoint not in UNTIMED_ENDPOINTS:
+        Metrics.start_request(request.url_rule.rule)
+
+
 # define CORS policy
 @app.after_request
 def after_request(response):
     header = response.headers
     header['Access-Control-Allow-Origin'] = '*'
+
+    stats = Metrics.end_request()
+    if stats is not None:
+        header['Server-Timing'] = stats.server_timing()
     return response
 
 
+@app.teardown_request
+def teardown_request(exc):
+    # requests that raise never reach after_request, so make sure their stats don't leak into the next request
+    Metrics.end_request()
+
+
 # define routes
 @app.route('/residency/<res_choice>/species/<spec_choice>/regions_stats')
 def get_region_stats(res_choice, spec_choice):
@@ -40,9 +179,11 @@ def get_region_stats(res_choice, spec_choice):
 
     # create a region object that has all the regions for the given species
     return_object = {'data': []}
+    cube = current_cube()
     for region in range(1, 8):
-        new_region = RegionsObject(res_choice, spec_choice, collection, END_YEAR, str(region))
-        return_object['data'].append(new_region.convert_to_dict())
+        new_region = RegionsObject(res_choice, spec_choice, collection, END_YEAR, str(region), stats_cube=cube)
+        with Metrics.timer('serialize', 'RegionsObject'):
+            return_object['data'].append(new_region.convert_to_dict())
     
     # send the appropriate data back
     return return_object
@@ -54,14 +195,16 @@ def get_district_stats(res_choice, spec_choice, reg_choice):
     res_choice = reformat_residency(res_choice)
 
     # create a region object and query for the districts within that region
-    results = RegionsObject(res_choice, spec_choice, collection, END_YEAR, reg_choice, False).get_districts()
+    cube = current_cube()
+    results = RegionsObject(res_choice, spec_choice, collection, END_YEAR, reg_choice, False, cube).get_districts()
 
     # loop through districts and create a district object for each entry, querying stats
     districts = []
     for result in results:
         district = result['_id']['district']
-        dist_obj = DistObject(collection, spec_choice, res_choice, district, END_YEAR)
-        districts.append(dist_obj.convert_to_dict())
+        dist_obj = DistObject(collection, spec_choice, res_choice, district, END_YEAR, stats_cube=cube)
+        with Metrics.timer('serialize', 'DistObject'):
+            districts.append(dist_obj.convert_to_dict())
     
     return {'data': districts}
 
@@ -71,35 +214,144 @@ def get_tag_stats(res_choice, spec_choice, reg_choice, dist_choice):
 
     res_choice = reformat_residency(res_choice)
 
-    # get a list of tags within the district
-    district = DistObject(collection, spec_choice, res_choice, dist_choice, END_YEAR, False)
-    tag_nums = district.get_tags()
+    # optional cursor based paging - "after" is the last tag number of the previous page
+    after = request.args.get('after')
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        limit = max(limit, 1)
+
+    # get a list of tags within the district, asking for one extra tag to know whether there is another page
+    cube = current_cube()
+    district = DistObject(collection, spec_choice, res_choice, dist_choice, END_YEAR, False, cube)
+    tag_nums = [result['_id']['tag num'] for result in district.get_tags(after, None if limit is None else limit + 1)]
+
+    next_tag = None
+    if limit is not None and len(tag_nums) > limit:
+        tag_nums = tag_nums[:limit]
+        next_tag = tag_nums[-1]
+
+    if wants_stream():
+        # the queries run while the response is streamed, so the stats for this request go along with the stream
+        stats = Metrics.detach_request()
+        return Response(stream_with_context(stream_tag_stats(tag_nums, spec_choice, res_choice, next_tag, stats, cube)),
+                        mimetype='application/x-ndjson')
 
     # loop through the tags and run queries on each tag, adding the results to the tags list
     tags = []
-    for result in tag_nums:
-        tag_num = result['_id']['tag num']
-        tag_obj = TagObject(tag_num, collection, spec_choice, 2017, END_YEAR, res_choice)
-        tags.append(tag_obj.convert_to_dict())
+    for tag_num in tag_nums:
+        tag_obj = TagObject(tag_num, collection, spec_choice, 2017, END_YEAR, res_choice, stats_cube=cube,
+                            forecaster=forecaster)
+        with Metrics.timer('serialize', 'TagObject'):
+            tags.append(tag_obj.convert_to_dict())
 
+    if limit is not None:
+        return {'data': tags, 'next': next_tag}
     return {'data': tags}
 
 
+def stream_tag_stats(tag_nums, spec_choice, res_choice, next_tag, stats, cube):
+    """Yields the stats for each tag as a line of json as soon as they are queried. When there is another page the
+    last line is {"next": <tag number to pass as "after">}."""
+    Metrics.resume_request(stats)
+    try:
+        for tag_num in tag_nums:
+            tag_obj = TagObject(tag_num, collection, spec_choice, 2017, END_YEAR, res_choice, stats_cube=cube,
+                                forecaster=forecaster)
+            with Metrics.timer('serialize', 'TagObject'):
+                line = json.dumps(tag_obj.convert_to_dict()) + '\n'
+            yield line
+
+        if next_tag is not None:
+            yield json.dumps({'next': next_tag}) + '\n'
+    finally:
+        Metrics.end_request()
+
+
 @app.route('/residency/<res_choice>/species/<spec_choice>/tags/<tag_id>')
 def get_tag(res_choice, spec_choice, tag_id):
     
     res_choice = reformat_residency(res_choice)
 
-    tag_obj = TagObject(tag_id, collection, spec_choice, 2017, END_YEAR, res_choice, True)
-    return {'tag exists': tag_obj.exists}
+    exists = tag_index.get().exists(spec_choice.upper(), res_choice.upper(), tag_id, 2017, END_YEAR)
+    return {'tag exists': exists}
+
+
+@app.route('/residency/<res_choice>/species/<spec_choice>/tag_search')
+def search_tags(res_choice, spec_choice):
+    """Typeahead search - returns the tags (with district and region) whose number starts with ?q="""
+
+    res_choice = reformat_residency(res_choice)
+    prefix = request.args.get('q', '')
+    limit = max(request.args.get('limit', 50, type=int), 1)
+
+    results = tag_index.get().search(spec_choice.upper(), res_choice.upper(), prefix, 2017, END_YEAR, limit)
+    return {'data': [entry.convert_to_dict() for entry in results]}
 
 
 @app.route('/residency/<res_choice>/species/<spec_choice>/tags/<tag_num>/stats')
 def get_ind_tag_stats(res_choice, spec_choice, tag_num):
     # create a tag object for the queried tag
-    tag_obj = TagObject(tag_num, collection, spec_choice, 2017, END_YEAR, res_choice)
-    data = tag_obj.convert_to_dict()
+    tag_obj = TagObject(tag_num, collection, spec_choice, 2017, END_YEAR, res_choice, stats_cube=current_cube(),
+                        forecaster=forecaster)
+    with Metrics.timer('serialize', 'TagObject'):
+        data = tag_obj.convert_to_dict()
 
     return ({'data': [data]})
 
-app.run()
+
+@app.route('/residency/<res_choice>/species/<spec_choice>/tags/<tag_num>/odds')
+def get_tag_odds(res_choice, spec_choice, tag_num):
+    """Returns next year's draw odds for the tag, as precomputed by precompute_odds.py"""
+
+    res_choice = reformat_residency(res_choice)
+
+    odds = odds_collection.find_one({'species': spec_choice.upper(), 'residency': res_choice.upper(),
+                                     'tag_num': tag_num}, projection={'_id': 0, 'generation': 0})
+    if odds is None:
+        return {'data': []}
+    return {'data': [odds]}
+
+
+@app.route('/residency/<res_choice>/species/<spec_choice>/points/<int:points>/rankings')
+def get_rankings(res_choice, spec_choice, points):
+    """Returns the top ?n= tags (default 10) statewide by success % for applicants with the given points. ?basis= is
+    historical (default) or predicted, and ?region= (repeatable) limits the ranking to those regions."""
+
+    res_choice = reformat_residency(res_choice)
+    basis = request.args.get('basis', 'historical').lower()
+    if basis not in BASES:
+        return {'error': f'basis must be one of {", ".join(BASES)}'}, 400
+    n = max(request.args.get('n', 10, type=int), 1)
+    regions = request.args.getlist('region')
+
+    ranked = rankings.get().top(spec_choice.upper(), res_choice.upper(), points, basis, n, regions)
+    return {'data': [entry.convert_to_dict() for entry in ranked]}
+
+
+@app.route('/metrics')
+def get_metrics():
+    return Response(Metrics.render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/healthz')
+def get_health():
+    """Liveness - the process is up and serving requests"""
+    return {'status': 'ok'}
+
+
+@app.route('/readyz')
+def get_readiness():
+    """Readiness - the in-memory data is built and mongo is reachable"""
+    if not is_warm():
+        return {'status': 'warming up'}, 503
+    try:
+        with pymongo.timeout(READY_PING_TIMEOUT):
+            collection.database.command('ping')
+    except pymongo.errors.PyMongoError as error:
+        return {'status': 'mongo unavailable', 'error': str(error)}, 503
+    return {'status': 'ready'}
+
+
+if __name__ == '__main__':
+    warm_up()
+    app.run()
@@ -0,0 +1,62 @@
+# gunicorn settings used by start_services.py. Each worker imports the service's server module and warms it up (builds
+# the in-memory data, connects to mongo) before it accepts any requests. gunicorn restarts workers that crash.
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+timeout = int(os.getenv('WORKER_TIMEOUT', '120'))
+graceful_timeout = 30
+accesslog = os.getenv('ACCESS_LOG')
+
+# seconds between warm up attempts when the first one fails (e.g. mongo isn't up yet)
+WARM_UP_RETRY = float(os.getenv('WARM_UP_RETRY', '10'))
+
+# the workers' request metrics are added up in a directory under METRICS_DIR (a temporary directory by default), see
+# Queries/RequestMetrics.py
+_temp_metrics_dir = None
+
+
+def on_starting(server):
+    global _temp_metrics_dir
+    base_dir = os.getenv('METRICS_DIR')
+    if not base_dir:
+        base_dir = _temp_metrics_dir = tempfile.mkdtemp(prefix='hunting-stats-metrics-')
+    # one directory per service, emptied so the totals start from 0 like a single process server's
+    metrics_dir = os.path.join(base_dir, os.path.basename(os.path.normpath(server.cfg.chdir)))
+    os.makedirs(metrics_dir, exist_ok=True)
+    for file_name in os.listdir(metrics_dir):
+        if file_name.endswith('.json'):
+            os.remove(os.path.join(metrics_dir, file_name))
+    # read by the workers, which inherit the environment
+    os.environ['WORKER_METRICS_DIR'] = metrics_dir
+
+
+def on_exit(server):
+    if _temp_metrics_dir:
+        shutil.rmtree(_temp_metrics_dir, ignore_errors=True)
+
+
+def post_worker_init(worker):
+    # the server module was loaded (as "server") by this worker just before this hook runs
+    import server
+    try:
+        server.warm_up()
+    except Exception:
+        # keep the worker and retry in the background - /readyz reports 503 until a warm up succeeds (or, on the
+        # Queries server, the requests have built the data)
+        worker.log.exception('warm up failed, retrying every %ss', WARM_UP_RETRY)
+        threading.Thread(target=retry_warm_up, args=(worker, server), daemon=True).start()
+
+
+def retry_warm_up(worker, server):
+    while True:
+        time.sleep(WARM_UP_RETRY)
+        try:
+            server.warm_up()
+        except Exception as error:
+            worker.log.warning('warm up failed: %s', error)
+        else:
+            worker.log.info('warm up succeeded')
+            return
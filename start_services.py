@@ -1,18 +1,99 @@
-import subprocess
+import argparse
+import importlib.util
 import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
 
 # this program starts all of the services that the react front end relies on to display data
-curr_dir = os.getcwd()
+#
+# On Linux/macOS with gunicorn installed, each service runs under gunicorn with several worker processes (which are
+# warmed up before they take requests and restarted if they crash, see gunicorn.conf.py). Otherwise, e.g. on Windows,
+# each service runs on the single process flask server.
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+GUNICORN_CONFIG = os.path.join(ROOT_DIR, 'gunicorn.conf.py')
+
+# name, directory, port and the environment variable setting its worker count
+SERVICES = [
+    ('Queries', 'Queries', 5000, 'QUERIES_WORKERS'),
+    ('Drawing Simulation', 'Drawing_Simulation', 58555, 'DRAWING_WORKERS'),
+]
+FORECAST_PATH = os.path.join(ROOT_DIR, 'Forecast_Applicants', 'CS361_forecast_applicants', 'calc_odds.py')
+
+
+def gunicorn_available():
+    return os.name != 'nt' and importlib.util.find_spec('gunicorn') is not None
+
+
+def start_service(name: str, directory: str, port: int, workers: int, host: str, use_gunicorn: bool):
+    service_dir = os.path.join(ROOT_DIR, directory)
+    if use_gunicorn:
+        print(f'Starting {name} Server ({workers} workers on {host}:{port})...')
+        command = [sys.executable, '-m', 'gunicorn', '--config', GUNICORN_CONFIG, '--chdir', service_dir,
+                   '--workers', str(workers), '--bind', f'{host}:{port}', 'server:app']
+    else:
+        print(f'Starting {name} Server...')
+        command = [sys.executable, os.path.join(service_dir, 'server.py')]
+    return subprocess.Popen(command, cwd=service_dir)
+
+
+def wait_until_ready(name: str, host: str, port: int, timeout: float):
+    """Polls the service's /readyz route until it answers 200 or timeout seconds have passed"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f'http://{host}:{port}/readyz', timeout=5) as response:
+                if response.status == 200:
+                    print(f'{name} Server is ready')
+                    return True
+        except (urllib.error.URLError, OSError):
+            pass
+        time.sleep(1)
+    print(f'{name} Server is not ready after {timeout:.0f}s')
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Start the hunting stats services.')
+    parser.add_argument('--host', default='localhost', help='address the gunicorn services bind to')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='default worker processes per service (QUERIES_WORKERS / DRAWING_WORKERS override it)')
+    parser.add_argument('--single-process', action='store_true', help='use the flask server even if gunicorn is here')
+    parser.add_argument('--ready-timeout', type=float, default=300, help='seconds to wait for each service to be ready')
+    args = parser.parse_args()
+
+    use_gunicorn = not args.single_process and gunicorn_available()
+    host = args.host if use_gunicorn else 'localhost'
+
+    processes = []
+    for name, directory, port, workers_env in SERVICES:
+        workers = int(os.getenv(workers_env, args.workers))
+        processes.append(start_service(name, directory, port, workers, host, use_gunicorn))
+
+    # the forecast service is only needed with FORECAST_BACKEND=service, and lives in its own repository
+    if os.path.exists(FORECAST_PATH):
+        print("Starting Forecast Server...")
+        processes.append(subprocess.Popen([sys.executable, FORECAST_PATH], cwd=os.path.dirname(FORECAST_PATH)))
 
-print("Starting Queries Server...")
-queries_command = curr_dir + '\Queries\server.py'
-subprocess.Popen(['py', queries_command], creationflags=subprocess.CREATE_NEW_CONSOLE)
+    # stop the services on a plain kill too, not only on ctrl-c
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        for name, directory, port, workers_env in SERVICES:
+            wait_until_ready(name, host, port, args.ready_timeout)
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        print('Stopping services...')
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in processes:
+            process.wait()
 
-print("Starting Forecast Server...")
-forecast_path = curr_dir + '\Forecast_Applicants\CS361_forecast_applicants\calc_odds.py'
-forecast_command = 'py ' + forecast_path
-subprocess.Popen(['py', forecast_path], creationflags=subprocess.CREATE_NEW_CONSOLE)
 
-print("Starting Drawing Simulation Server...")
-ds_path = curr_dir + '\Drawing_Simulation\server.py'
-subprocess.Popen(['py', ds_path], creationflags=subprocess.CREATE_NEW_CONSOLE)
\ No newline at end of file
+if __name__ == '__main__':
+    main()
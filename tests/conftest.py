@@ -0,0 +1,8 @@
+# The services aren't packages - their modules import each other by name from their own directory - so the tests put
+# both directories on the path, Queries first (both have a Metrics.py and a server.py, the tests use the Queries ones).
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in ('Queries', 'Drawing_Simulation'):
+    sys.path.append(os.path.join(ROOT_DIR, directory))
@@ -0,0 +1,29 @@
+import numpy as np
+import Forecast
+
+
+def test_unsuccessful_applicants_move_up_a_point():
+    # two years of one tag where everyone who missed came back: the forecast is last year's misses, one point up (the
+    # top category keeps its own), and the 0 point category follows its trend
+    applicants = np.array([[[10, 4, 2], [12, 8, 6]]])
+    successes = np.array([[[2, 0, 0], [3, 2, 1]]])
+
+    forecast = Forecast.forecast_applicants(applicants, successes)
+    assert forecast.tolist() == [[14, 9, 11]]
+
+
+def test_retention_is_learned_per_point_category():
+    # only half of the 0 point misses come back, and all of the others
+    applicants = np.array([[[10, 4, 2], [10, 5, 6], [10, 5, 11]]])
+    successes = np.zeros_like(applicants)
+
+    forecast = Forecast.forecast_applicants(applicants, successes)
+    assert forecast.tolist() == [[10, 5, 16]]
+
+
+def test_retention_is_bounded():
+    applicants = np.array([[[1, 0], [1, 100]]])
+    successes = np.zeros_like(applicants)
+
+    forecast = Forecast.forecast_applicants(applicants, successes)
+    assert forecast[0, 1] == Forecast.MAX_RETENTION * 101
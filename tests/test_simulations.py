@@ -0,0 +1,60 @@
+# The vectorized engines (SweepSimul, StatewideSimul) claim to run the same drawing as the DrawSimul bag. These check
+# that they hand out the tags the same way, and that the odds of all three agree within sampling noise.
+import numpy as np
+import DrawSimul
+import StatewideSimul
+import SweepSimul
+
+EXPECTED_APPS = [6, 4, 3, 2, 1] + [0] * 16
+NUM_TAGS = 5
+ITERATIONS = 2000
+
+# most % points two estimates of the same odds may differ by (about 4.5 standard deviations for these tags)
+TOLERANCE = 5.0
+
+
+def test_allocate_hands_out_each_quota_by_key():
+    choice = np.array([0, 0, 0, 1, 1, -1])
+    keys = np.array([0.3, 0.1, 0.2, 0.5, 0.4, 0.0])
+    eligible = np.array([True, True, True, True, False, True])
+
+    drew = StatewideSimul.allocate(choice, keys, eligible, np.array([2, 1]))
+    assert drew.tolist() == [False, True, True, True, False, False]
+
+
+def test_second_choices_get_the_leftover_tags():
+    # tag 0 has 1 tag for 3 applicants who all list tag 1 second, tag 1 has 5 tags for 1 applicant
+    pool = StatewideSimul.ApplicantPool.from_tag_counts(np.array([[3], [1]]), {0: {1: 1.0}}, seed=0)
+    results = StatewideSimul.StatewideDrawing(pool, [1, 5]).run(50, 1, seed=0)
+
+    assert results.first_choice_perc()[:, 0].tolist() == [33.3, 100.0]
+    assert results.second_choice_perc()[1, 0] == 66.7
+
+
+def test_statewide_runs_split_over_workers_add_up():
+    pool = StatewideSimul.ApplicantPool.from_tag_counts(np.array([EXPECTED_APPS]))
+    results = StatewideSimul.StatewideDrawing(pool, [NUM_TAGS]).run(101, 2, seed=0)
+
+    assert results.iterations == 101
+    assert results.first_wins.sum() == 101 * NUM_TAGS
+
+
+def test_engines_agree_with_the_bag():
+    _, bag_perc = DrawSimul.simulate_odds(EXPECTED_APPS, 'test', NUM_TAGS, ITERATIONS)
+    _, _, sweep_perc = SweepSimul.sweep_odds(EXPECTED_APPS, [NUM_TAGS], [1.0], ITERATIONS, seed=0)
+    pool = StatewideSimul.ApplicantPool.from_tag_counts(np.array([EXPECTED_APPS]))
+    statewide_perc = StatewideSimul.StatewideDrawing(pool, [NUM_TAGS]).run(ITERATIONS, 1, seed=1).first_choice_perc()
+
+    assert np.abs(sweep_perc[0, 0] - bag_perc).max() < TOLERANCE
+    assert np.abs(statewide_perc[0, :len(EXPECTED_APPS)] - bag_perc).max() < TOLERANCE
+
+
+def test_sweep_scenarios_share_their_draws():
+    applicants, wins, perc = SweepSimul.sweep_odds(EXPECTED_APPS, [0, 2, 5, 20], [0.5, 1.0], 200, seed=0)
+
+    assert applicants[0, :5].tolist() == [3, 2, 2, 1, 0]
+    # with the same draws, every extra tag goes to someone - no point category ever loses tags
+    assert (np.diff(wins, axis=1) >= 0).all()
+    assert (wins[:, 0] == 0).all()
+    # more tags than applicants: everyone draws
+    assert (perc[:, 3][applicants > 0] == 100).all()
@@ -0,0 +1,47 @@
+import os
+import mongomock
+import numpy as np
+import pytest
+import load_test
+import Snapshot
+from StatsCube import CUBE_ARRAYS, StatsCube
+
+
+@pytest.fixture(scope='module')
+def cube():
+    doc_collection = mongomock.MongoClient().hunting_research.drawing_results
+    doc_collection.insert_many(list(load_test.synthetic_documents(1, 2, 2020, 2021)))
+    return StatsCube.from_collection(doc_collection)
+
+
+def test_snapshot_round_trip(tmp_path, cube):
+    Snapshot.write_snapshot(cube, str(tmp_path))
+    mapped = Snapshot.load_current(str(tmp_path))
+
+    assert mapped.generation == cube.generation
+    assert Snapshot.snapshot_generation(str(tmp_path)) == cube.generation
+    assert mapped.blocks.keys() == cube.blocks.keys()
+    for key, block in cube.blocks.items():
+        mapped_block = mapped.blocks[key]
+        assert (mapped_block.tags, mapped_block.districts, mapped_block.regions) == \
+               (block.tags, block.districts, block.regions)
+        for name in CUBE_ARRAYS:
+            assert np.array_equal(getattr(mapped_block, name), getattr(block, name)), name
+
+    tag = cube.blocks[('ELK', 'RESIDENT')].tags[0]
+    assert mapped.point_stats('ELK', 'RESIDENT', tag, 2021) == cube.point_stats('ELK', 'RESIDENT', tag, 2021)
+
+
+def test_snapshot_keeps_the_newest(tmp_path, cube):
+    paths = [Snapshot.write_snapshot(cube, str(tmp_path), keep=2) for _ in range(4)]
+
+    assert sorted(file for file in os.listdir(tmp_path) if file.endswith('.snap')) == \
+           sorted(os.path.basename(path) for path in paths[-2:])
+    assert Snapshot.current_snapshot(str(tmp_path))['file'] == os.path.basename(paths[-1])
+
+
+def test_not_a_snapshot(tmp_path):
+    path = tmp_path / 'other.snap'
+    path.write_bytes(b'not a snapshot at all')
+    with pytest.raises(ValueError):
+        Snapshot.read_snapshot(str(path))
@@ -0,0 +1,61 @@
+# The stats cube backend has to give the same answers as the aggregations it replaces. These run every Queries route
+# against a mongomock collection of synthetic drawing results with both backends and compare the responses.
+import mongomock
+import pytest
+import load_test
+import server
+
+
+@pytest.fixture(scope='module')
+def collection():
+    doc_collection = mongomock.MongoClient().hunting_research.drawing_results
+    # one species keeps mongomock (which runs the aggregations in python) quick
+    documents = load_test.synthetic_documents(1, 2, server.END_YEAR - 1, server.END_YEAR)
+    doc_collection.insert_many([doc for doc in documents if doc['species'] == 'ELK'])
+    return doc_collection
+
+
+def route_urls(collection):
+    routes = load_test.build_routes(collection, server.END_YEAR, seed=0)
+    urls = [url for name, route_urls in routes.items() if name != 'metrics' for url in route_urls]
+
+    # both pages of a district's tags
+    for url in routes['district tags']:
+        first_tag = collection.find_one({'district': url.split('/')[-2]}, sort=[('tag_num', 1)])['tag_num']
+        urls += [f'{url}?limit=1', f'{url}?limit=1&after={first_tag}', f'{url}?limit=1&after={first_tag}&stream=true']
+    return urls
+
+
+def responses(monkeypatch, collection, backend: str, urls: list):
+    monkeypatch.setattr(server, 'USE_STATS_CUBE', backend == 'cube')
+    server.set_collections(collection, collection.database.draw_odds)
+    client = server.app.test_client()
+    results = {}
+    for url in urls:
+        response = client.get(url)
+        results[url] = response.status_code, response.get_data(as_text=True)
+    return results
+
+
+def test_cube_matches_aggregations(monkeypatch, collection):
+    urls = route_urls(collection)
+    from_mongo = responses(monkeypatch, collection, 'mongo', urls)
+    from_cube = responses(monkeypatch, collection, 'cube', urls)
+
+    for url in urls:
+        assert from_mongo[url][0] == 200, url
+        assert from_cube[url] == from_mongo[url], url
+
+
+def test_district_tags_pages(monkeypatch, collection):
+    monkeypatch.setattr(server, 'USE_STATS_CUBE', True)
+    server.set_collections(collection, collection.database.draw_odds)
+    client = server.app.test_client()
+    url = '/residency/resident/species/elk/region/1/district/100/tags'
+
+    everything = [tag['tag'] for tag in client.get(url).get_json()['data']]
+    first_page = client.get(f'{url}?limit=1').get_json()
+    second_page = client.get(f"{url}?limit=1&after={first_page['next']}").get_json()
+    assert len(everything) == 2
+    assert [tag['tag'] for tag in first_page['data'] + second_page['data']] == everything
+    assert second_page['next'] is None